@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import platform
+import stat
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from functools import lru_cache
+from itertools import product
+
+import numpy as np
+import rdkit
+from rdkit import Chem
+from rdkit import RDLogger
+from rdkit.Chem import AllChem
+
+from AICatalysis.benchmark.gaussian_bench import write_out_fixture, write_fchk_fixture
+from AICatalysis.calculator.descriptor import RdkitDescriptor, RdkitDescriptorBatch, SmilesDescriptor, \
+    MultiwinDescriptor
+from AICatalysis.calculator.gaussian import OUTFile, FCHKFile
+
+RDLogger.DisableLog('rdApp.*')
+
+# substituents and cores of the synthetic molecule sets, combined as <core>.format(*substituents)
+Substituents = ["C", "CC", "C(C)C", "C(C)(C)C", "C1CCCCC1", "c1ccccc1", "c1ccc(C)cc1", "c1ccc(OC)cc1",
+                "c1ccc(F)cc1", "c1ccc(C(F)(F)F)cc1", "c1ccccc1-c1ccccc1", "C1CCCC1"]
+Cores = ["P({})({}){}", "{}P({})c1ccccc1-c1ccccc1{}", "O=C({})N({}){}", "{}c1ccc({})cc1{}"]
+
+# log of one single-session Multiwfn run (see <MultiwinDescriptor.run_session>), replayed by the stub executable
+MultiwfnLog = """\
+ ************ Main function menu ************
+ Global surface minimum:   -0.05 a.u. at
+ Global surface maximum:    0.06 a.u. at
+ Volume:   100.0 Bohr^3  (  250.00 Angstrom^3)
+ Estimated density according to mass and volume (M/V):    1.1 g/cm^3
+ Overall surface area:   300.0 Bohr^2  (  120.0 Angstrom^2)
+ Positive surface area:   150.0 Bohr^2  (   60.0 Angstrom^2)
+ Negative surface area:   150.0 Bohr^2  (   60.0 Angstrom^2)
+ Overall average value:   0.001 a.u. (  0.6 kcal/mol)
+ Positive average value:   0.02 a.u. (  12 kcal/mol)
+ Negative average value:   -0.02 a.u. ( -12 kcal/mol)
+ Overall variance (sigma^2_tot):  0.0003 a.u.^2 (  100 (kcal/mol)^2)
+ Positive variance:  0.0001 a.u.^2 (  40 (kcal/mol)^2)
+ Negative variance:  0.0002 a.u.^2 (  60 (kcal/mol)^2)
+ Balance of charges (nu):   0.2
+ Molecular polarity index (MPI):   0.5 eV (  11 kcal/mol)
+ Nonpolar surface area (|ESP| <= 10 kcal/mol):     80.0 Angstrom^2  ( 66.67 %)
+ Polar surface area (|ESP| > 10 kcal/mol):     40.0 Angstrom^2  ( 33.33 %)
+ ************ Main function menu ************
+ Radius of the system:     5.0 Angstrom
+ Length of the three sides:     1.0    2.0    3.0 Angstrom
+ ************ Main function menu ************
+ Average value:   0.45 a.u.
+ ************ Main function menu ************
+ Bond orders with absolute value >=  0.050000
+ #    1:     1(C )     2(H )    0.95
+ #    2:     1(C )     3(H )    0.97
+
+ If outputting bond order matrix to bndmat.txt in current folder? (y/n)
+ ************ Main function menu ************
+ Total valences and free valences defined by Mayer:
+ Atom     1(C ) :    3.9    0.1
+ Atom     2(H ) :    0.9    0.1
+
+ If outputting bond order matrix to bndmat.txt in current folder? (y/n)
+ ************ Main function menu ************
+"""
+
+@lru_cache(maxsize=None)
+def _distinct_smiles():
+    """
+    Canonical SMILES of every distinct <Cores> x <Substituents> combination, fewer than the combinations as the
+    symmetric cores give the same structure for permuted substituents
+    """
+    smiles = {}
+    for core in Cores:
+        for substituents in product(Substituents, repeat=3):
+            mol = Chem.MolFromSmiles(core.format(*substituents))
+            if mol is not None:
+                smiles.setdefault(Chem.MolToSmiles(mol))
+    return tuple(smiles)
+
+
+def synthetic_smiles(n, seed=0):
+    """
+    Deterministic set of <n> drug/ligand-like SMILES built from <Cores> and <Substituents>, distinct up to the
+    number of distinct structures (see <_distinct_smiles>), which are repeated beyond it
+
+    """
+    distinct = _distinct_smiles()
+    order = np.random.default_rng(seed).permutation(len(distinct))
+    return [distinct[order[index % len(distinct)]] for index in range(n)]
+
+
+def write_fixtures(smiles_list, root, n_orbitals=20, basis_num=60, n_padding=200):
+    """
+    Write an <out>/<name>.out and <fchk>/<name>.fchk pair for each molecule, the output holds its embedded
+    geometry so that every descriptor family can read it
+
+    Returns:
+        out_names (list): the .out files, the molecules which can not be embedded are skipped
+    """
+    os.makedirs(os.path.join(root, "out"), exist_ok=True)
+    os.makedirs(os.path.join(root, "fchk"), exist_ok=True)
+    out_names = []
+    for index, smiles in enumerate(smiles_list):
+        mol = Chem.AddHs(Chem.MolFromSmiles(smiles))
+        if AllChem.EmbedMolecule(mol, randomSeed=index) != 0:
+            continue
+        conformer = mol.GetConformer()
+        atoms = [[atom.GetSymbol(), *conformer.GetAtomPosition(atom.GetIdx())] for atom in mol.GetAtoms()]
+        out_name = os.path.join(root, "out", f"{index}-M{index}.out")
+        write_out_fixture(out_name, n_orbitals=n_orbitals, n_padding=n_padding, atoms=atoms)
+        write_fchk_fixture(os.path.join(root, "fchk", f"{index}-M{index}.fchk"), basis_num=basis_num, seed=index)
+        out_names.append(out_name)
+    return out_names
+
+
+def install_stub_tools(bin_dir):
+    """
+    Write a stub Multiwfn.exe executable into <bin_dir> and put it first on the PATH, it replays <MultiwfnLog>
+    after reading its standard input
+
+    """
+    os.makedirs(bin_dir, exist_ok=True)
+    script = os.path.join(bin_dir, "Multiwfn.exe")
+    with open(script + ".txt", "w") as f:
+        f.write(MultiwfnLog)
+    with open(script, "w") as f:
+        f.write(f"#!/bin/sh\ncat > /dev/null\ncat '{script}.txt'\n")
+    os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+
+def families(smiles_list, out_names):
+    """
+    Returns:
+        families (dict): name => callable which computes the family for the whole set
+    """
+    fchk_names = [out_name.replace(f"{os.sep}out{os.sep}", f"{os.sep}fchk{os.sep}").replace(".out", ".fchk")
+                  for out_name in out_names]
+    return {
+        "parse_out": lambda: [OUTFile(name).read() for name in out_names],
+        "parse_fchk": lambda: [FCHKFile(name).read().mo_coefficients([0, 1]) for name in fchk_names],
+        "smiles": lambda: [SmilesDescriptor(name).calc_descriptor() for name in out_names],
+        "rdkit": lambda: [RdkitDescriptor(name).calc_descriptor() for name in out_names],
+        "rdkit_fast": lambda: [RdkitDescriptor(name, descriptors="fast").calc_descriptor() for name in out_names],
+        "rdkit_batch": lambda: RdkitDescriptorBatch(workers=1).calc(smiles_list),
+        "multiwfn": lambda: [MultiwinDescriptor(name).calc_descriptor() for name in out_names],
+    }
+
+
+def _measure(func, memory=True):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def benchmark(sizes=(10, 100), selected=None, memory=True, seed=0):
+    """
+    Time every descriptor family on synthetic molecule sets of growing size
+
+    Args:
+        sizes: number of molecules of each set
+        selected: families to run, default: all of <families>
+        memory: also record the peak traced memory (runs each family a second time)
+
+    Returns:
+        results (list): one dict per (family, size), times in s and memory in MB
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix="descriptor_bench_") as tmp_dir:
+        install_stub_tools(os.path.join(tmp_dir, "bin"))
+        for size in sizes:
+            smiles_list = synthetic_smiles(size, seed=seed)
+            out_names = write_fixtures(smiles_list, os.path.join(tmp_dir, f"set_{size}"))
+            for family, func in families(smiles_list, out_names).items():
+                if selected is not None and family not in selected:
+                    continue
+                n = len(smiles_list) if family == "rdkit_batch" else len(out_names)
+                elapsed, peak = _measure(func, memory)
+                results.append({"family": family, "n_molecules": n, "total_s": elapsed,
+                                "per_molecule_ms": 1000 * elapsed / n, "per_1k_s": 1000 * elapsed / n,
+                                "peak_MB": None if peak is None else peak / 2 ** 20})
+                print(f"{family:<12}{n:>7} molecules  {1000 * elapsed / n:>9.3f} ms/mol  "
+                      f"{1000 * elapsed / n:>9.2f} s/1k" + ("" if peak is None else f"  {peak / 2 ** 20:>8.1f} MB"))
+    return results
+
+
+def compare(previous, current):
+    """
+    Ratio previous/current of the per-molecule time of each (family, size) found in both runs, > 1 is faster
+
+    """
+    before = {(item["family"], item["n_molecules"]): item["per_molecule_ms"] for item in previous["results"]}
+    speedup = {}
+    for item in current["results"]:
+        key = (item["family"], item["n_molecules"])
+        if key in before and item["per_molecule_ms"] > 0:
+            speedup[f"{key[0]}@{key[1]}"] = before[key] / item["per_molecule_ms"]
+    return speedup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the descriptor families on synthetic molecules")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--families", nargs="+", default=None, help="default: all")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory pass")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="descriptor_bench.json")
+    parser.add_argument("--compare", default=None, help="former result file, prints the speedup of each family")
+    args = parser.parse_args()
+
+    report = {"meta": {"date": datetime.now().isoformat(timespec="seconds"), "host": platform.node(),
+                       "platform": platform.platform(), "python": platform.python_version(),
+                       "numpy": np.__version__, "rdkit": rdkit.__version__, "cpu_count": os.cpu_count(),
+                       "sizes": args.sizes, "seed": args.seed},
+              "results": benchmark(args.sizes, args.families, not args.no_memory, args.seed)}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        for key, speedup in compare(previous, report).items():
+            print(f"{key:<24}x{speedup:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+import argparse
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from AICatalysis.calculator.gaussian import OUTFile, LazyOUTFile, FCHKFile
+
+
+def write_out_fixture(file, n_atoms=60, n_orbitals=600, n_padding=200000, atoms=None):
+    """
+    Write a synthetic Gaussian output which contains every section read by <OUTFile>
+
+    Args:
+        file: output path
+        n_atoms: number of atoms in the Z-matrix and Mulliken charges
+        n_orbitals: number of occupied (and virtual) orbital eigenvalues
+        n_padding: number of filler lines, which mimic the frequency/NBO blocks of a real log
+        atoms: [[symbol, x, y, z], ...] of a real geometry, replaces the <n_atoms> dummy atoms, its Mulliken
+            charges sum to 0
+
+    """
+    symbols = ['C', 'H', 'O', 'N', 'P']
+    if atoms is None:
+        atoms = [[symbols[i % len(symbols)], i * 0.1, -i * 0.2, i * 0.05] for i in range(n_atoms)]
+        charges = [0.001 * i for i in range(n_atoms)]
+    else:
+        n_atoms = len(atoms)
+        charges = [0.01 * (-1) ** i if i < n_atoms - n_atoms % 2 else 0.0 for i in range(n_atoms)]
+    with open(file, "w") as f:
+        f.write(" Entering Gaussian System\n")
+        f.write(" Symbolic Z-matrix:\n")
+        f.write(" Charge =  0 Multiplicity = 1\n")
+        for symbol, x, y, z in atoms:
+            f.write(f" {symbol:<20}{x:>10.5f}{y:>14.5f}{z:>14.5f}\n")
+        f.write(" \n \n")
+        f.write(" GradGradGradGradGradGradGradGradGradGradGradGradGradGradGradGradGradGrad\n")
+        for i in range(n_padding):
+            f.write(f" {i:>6} {i % 7:>4} {0.001 * i:>12.6f} {-0.002 * i:>12.6f} {0.003 * i:>12.6f}\n")
+        f.write(" The electronic state is 1-A.\n")
+        for i in range(0, n_orbitals, 5):
+            values = "".join(f"{-10.0 + 0.01 * j:>10.5f}" for j in range(i, min(i + 5, n_orbitals)))
+            f.write(f" Alpha  occ. eigenvalues --{values}\n")
+        for i in range(0, n_orbitals, 5):
+            values = "".join(f"{0.01 + 0.01 * j:>10.5f}" for j in range(i, min(i + 5, n_orbitals)))
+            f.write(f" Alpha virt. eigenvalues --{values}\n")
+        f.write("          Condensed to atoms (all electrons):\n")
+        f.write(" Mulliken charges:\n")
+        f.write("               1\n")
+        for i, (symbol, charge) in enumerate(zip([atom[0] for atom in atoms], charges)):
+            f.write(f" {i + 1:>5}  {symbol:<3}{charge:>12.6f}\n")
+        f.write(" Dipole moment (field-independent basis, Debye):\n")
+        f.write("    X=              0.1000    Y=             -0.2000    Z=              0.3000"
+                "  Tot=              0.3742\n")
+        f.write(" ----------------------------------------------------------------------\n")
+        f.write(" 1\\1\\GINC-NODE\\Freq\\RB3LYP\\def2TZVP\\C1H1\\USER\\01-Jan-2024\\0\\\\#\n")
+        f.write(" \\\\Version=ES64L-G16RevC.01\\State=1-A\\HF=-1234.5678901\\RMSD=1.234e-\n")
+        f.write(" 09\\RMSF=1.234e-05\\ZeroPoint=0.1234567\\Thermal=0.1334567\\ETot=-1234.\n")
+        f.write(" 4444333\\HTot=-1234.4434892\\GTot=-1234.5012345\\Dipole=0.1,0.2,0.3\\\\@\n")
+        f.write(" Normal termination of Gaussian 16.\n")
+
+
+def write_fchk_fixture(file, basis_num=400, seed=0):
+    """
+    Write a synthetic formatted checkpoint with a square "Alpha MO coefficients" array
+
+    Args:
+        file: output path
+        basis_num: number of basis functions (and orbitals)
+        seed: random seed of the coefficients
+
+    """
+
+    def write_array(f, key, values, fmt, per_line):
+        kind = "R" if fmt.endswith("E") else "I"
+        f.write(f"{key:<40}   {kind}   N={len(values):>12}\n")
+        for i in range(0, len(values), per_line):
+            f.write("".join(format(value, fmt) for value in values[i:i + per_line]) + "\n")
+
+    coeff = np.random.default_rng(seed).uniform(-1, 1, basis_num * basis_num)
+    with open(file, "w") as f:
+        f.write("synthetic\nSP        RB3LYP                                                      def2TZVP\n")
+        f.write(f"{'Number of atoms':<40}   I     {10:>12}\n")
+        f.write(f"{'Number of basis functions':<40}   I     {basis_num:>12}\n")
+        write_array(f, "Shell types", [i % 3 for i in range(basis_num // 3)], "12d", 6)
+        write_array(f, "Alpha Orbital Energies", np.linspace(-10, 1, basis_num), "16.8E", 5)
+        write_array(f, "Alpha MO coefficients", coeff, "16.8E", 5)
+        write_array(f, "Orthonormal basis", np.zeros(basis_num), "16.8E", 5)
+
+
+def legacy_read_fchk(name):
+    """
+    The former <FCHKFile.read>, which converts every coefficient to a Python float
+
+    Returns:
+        coeff (np.ndarray): the MO coefficients matrix
+    """
+    with open(name, "r") as f:
+        strings = f.readlines()
+
+    basis_num, lns, lne = None, -1, -1
+    for index, line in enumerate(strings):
+        if line.startswith("Number of basis functions"):
+            basis_num = int(line.split()[-1])
+        elif line.startswith("Alpha MO coefficients"):
+            lns = index
+        elif line.startswith("Beta MO coefficients") or line.startswith("Orthonormal basis"):
+            lne = index
+            break
+    coeff = list(map(float, [item for line in strings[lns + 1:lne] for item in line.split()]))
+    return np.array(coeff).reshape((basis_num, -1))
+
+
+def legacy_read(name):
+    """
+    The former <OUTFile.read>, which loads the whole log and rescans it once per section
+
+    Returns:
+        fields (dict): the same fields filled by <OUTFile.read>
+    """
+    with open(name, "r") as f:
+        strings = f.readlines()
+
+    lns, lne = None, None
+    for index, line in enumerate(strings):
+        if line.startswith(" Symbolic Z-matrix"):
+            lns = index
+        elif line.startswith(" GradGrad") or line.startswith(" Add virtual"):
+            lne = index
+        if lns is not None and lne is not None:
+            break
+    _format = lambda x: [str(x[0]), float(x[1]), float(x[2]), float(x[3])]
+    input_atoms = list(map(_format, [l.split() for l in strings[lns + 2:lne - 2]]))
+
+    mulliken_index = [index for index, line in enumerate(strings)
+                      if line.startswith(" Mulliken charges:") or
+                      line.startswith(" Mulliken charges and spin densities:")]
+    mulliken_charge = [float(line.split()[2])
+                       for line in strings[mulliken_index[-1] + 2:mulliken_index[-1] + 2 + len(input_atoms)]]
+
+    dipole_index = [index for index, line in enumerate(strings) if line.startswith(" Dipole moment")][-1] + 1
+    dipole_moment = list(map(float, strings[dipole_index].split()[1::2]))
+    dipole_moment = {"X": dipole_moment[0], "Y": dipole_moment[1], "Z": dipole_moment[2], "Tot": dipole_moment[3]}
+
+    try:
+        orb_s_index = [index for index, line in enumerate(strings)
+                       if line.startswith(" The electronic state")][-1] + 1
+    except IndexError:
+        orb_s_index = [index for index, line in enumerate(strings)
+                       if line.startswith(" Unable to determine electronic state:")][-1] + 1
+    orb_e_index = [index for index, line in enumerate(strings) if
+                   line.startswith("          Condensed to atoms")][-1]
+    orbital_occ = list(map(float, [item for line in strings[orb_s_index:orb_e_index] if "occ." in line
+                                   for item in re.sub('-', ' ', line.split("--")[1]).split()]))
+    orbital_virt = list(map(float, [item for line in strings[orb_s_index:orb_e_index] if "virt." in line
+                                    for item in line.split("--")[1].split()]))
+
+    out_s_index = [index for index, line in enumerate(strings) if
+                   line.startswith(' ----------------------------------------------------------------------')][-1]
+    out_e_index = [index for index, line in enumerate(strings) if line.endswith('@\n')][-1]
+    energy = "".join(strings[out_s_index:out_e_index + 1]).replace('\n', '').replace(' ', '').split('\\')
+    keywords = {'HF', 'ZeroPoint', 'Thermal', 'ETot', 'HTot', 'GTot'}
+    energy = {line.split("=")[0]: float(line.split("=")[1]) for line in energy if line.split("=")[0] in keywords}
+
+    return {"input_atoms": input_atoms, "mulliken_charge": mulliken_charge, "dipole_moment": dipole_moment,
+            "homo": -orbital_occ[-1], "homo_index": len(orbital_occ) - 1,
+            "lumo": orbital_virt[0], "lumo_index": len(orbital_occ), "energy": energy}
+
+
+def _measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, min(times), peak
+
+
+def benchmark(name, repeat=3):
+    """
+    Compare the streaming <OUTFile.read> with the former implementation on one output file, and time the
+    <LazyOUTFile> subset used by <MultiwinDescriptor> before and after its index is persisted
+
+    Returns:
+        report (dict): best wall time (s) and peak traced memory (MB) of both readers, and the speedup
+    """
+    legacy, legacy_time, legacy_peak = _measure(lambda: legacy_read(name), repeat)
+    stream, stream_time, stream_peak = _measure(lambda: OUTFile(name).read(), repeat)
+
+    for key, value in legacy.items():
+        if getattr(stream, key) != value:
+            raise RuntimeError(f"Streaming reader disagrees with the former reader on <{key}>")
+
+    # subset read by <MultiwinDescriptor.EnergyRelated/OrbRelated>, the first open builds the persisted index
+    def energy_related():
+        out = LazyOUTFile(name).read()
+        return len(out.input_atoms), out.energy, out.homo, out.lumo
+
+    _, lazy_cold_time, _ = _measure(energy_related, 1)
+    _, lazy_warm_time, lazy_peak = _measure(energy_related, repeat)
+
+    return {"file": str(name), "size_MB": os.path.getsize(name) / 2 ** 20,
+            "legacy_time": legacy_time, "stream_time": stream_time, "speedup": legacy_time / stream_time,
+            "legacy_peak_MB": legacy_peak / 2 ** 20, "stream_peak_MB": stream_peak / 2 ** 20,
+            "lazy_cold_time": lazy_cold_time, "lazy_warm_time": lazy_warm_time, "lazy_peak_MB": lazy_peak / 2 ** 20}
+
+
+def benchmark_fchk(name, rows=(0, 1), repeat=3):
+    """
+    Compare the memory-mapped <FCHKFile> with the former reader, for the full matrix and for a few rows
+
+    Returns:
+        report (dict): best wall time (s) and peak traced memory (MB) of each reader
+    """
+    legacy, legacy_time, legacy_peak = _measure(lambda: legacy_read_fchk(name), repeat)
+    full, full_time, full_peak = _measure(lambda: FCHKFile(name).read().coeff, repeat)
+    part, rows_time, rows_peak = _measure(lambda: FCHKFile(name).read().mo_coefficients(rows), repeat)
+
+    if not (np.array_equal(legacy, full) and np.array_equal(legacy[list(rows)], part)):
+        raise RuntimeError("Memory-mapped reader disagrees with the former reader")
+
+    return {"file": str(name), "size_MB": os.path.getsize(name) / 2 ** 20,
+            "legacy_time": legacy_time, "full_time": full_time, "rows_time": rows_time,
+            "legacy_peak_MB": legacy_peak / 2 ** 20, "full_peak_MB": full_peak / 2 ** 20,
+            "rows_peak_MB": rows_peak / 2 ** 20}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the Gaussian output reader")
+    parser.add_argument("files", nargs="*", help="Gaussian .out/.fchk files, synthetic ones are used if omitted")
+    parser.add_argument("--padding", type=int, default=200000, help="filler lines of the synthetic output")
+    parser.add_argument("--basis", type=int, default=400, help="basis functions of the synthetic checkpoint")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = args.files
+        if not files:
+            files = [os.path.join(tmp_dir, "synthetic.out"), os.path.join(tmp_dir, "synthetic.fchk")]
+            write_out_fixture(files[0], n_padding=args.padding)
+            write_fchk_fixture(files[1], basis_num=args.basis)
+        for file in files:
+            if file.endswith(".fchk"):
+                report = benchmark_fchk(file, repeat=args.repeat)
+                print(f"{report['file']} ({report['size_MB']:.1f} MB): "
+                      f"legacy {report['legacy_time']:.3f}s / {report['legacy_peak_MB']:.1f} MB, "
+                      f"mmap full {report['full_time']:.3f}s / {report['full_peak_MB']:.1f} MB, "
+                      f"mmap rows {report['rows_time']:.4f}s / {report['rows_peak_MB']:.2f} MB")
+                continue
+            report = benchmark(file, repeat=args.repeat)
+            print(f"{report['file']} ({report['size_MB']:.1f} MB): "
+                  f"legacy {report['legacy_time']:.3f}s / {report['legacy_peak_MB']:.1f} MB, "
+                  f"stream {report['stream_time']:.3f}s / {report['stream_peak_MB']:.1f} MB, "
+                  f"speedup x{report['speedup']:.2f}, "
+                  f"lazy subset {report['lazy_cold_time']:.3f}s cold / {report['lazy_warm_time']:.4f}s indexed")
@@ -0,0 +1,95 @@
+import argparse
+import time
+
+import yaml
+from rdkit import Chem
+from rdkit import RDLogger
+from rdkit.Chem import Descriptors, rdMolDescriptors, rdPartialCharges
+
+RDLogger.DisableLog('rdApp.*')
+
+# phosphine ligands and typical substrates/solvents of the reaction records
+DefaultSmiles = [
+    "c1ccc(P(c2ccccc2)c2ccccc2)cc1",
+    "Cc1ccccc1P(c1ccccc1C)c1ccccc1C",
+    "C1CCC(P(C2CCCCC2)C2CCCCC2)CC1",
+    "CC(C)(C)P(C(C)(C)C)C(C)(C)C",
+    "CC(C)c1cc(C(C)C)c(-c2ccccc2P(C2CCCCC2)C2CCCCC2)c(C(C)C)c1",
+    "COc1cccc(OC)c1-c1ccccc1P(C1CCCCC1)C1CCCCC1",
+    "CC1(C)c2cccc(P(c3ccccc3)c3ccccc3)c2Oc2c(P(c3ccccc3)c3ccccc3)cccc21",
+    "c1ccc(P(CCCCP(c2ccccc2)c2ccccc2)c2ccccc2)cc1",
+    "c1ccc(P(c2ccccc2)c2ccc3ccccc3c2-c2c(P(c3ccccc3)c3ccccc3)ccc3ccccc23)cc1",
+    "CC(C)(C)P(c1ccccc1-c1ccccc1)C(C)(C)C",
+    "Brc1ccccc1",
+    "Ic1ccc(cc1)C(=O)OC",
+    "CN(C)C=O",
+    "O=C([O-])[O-].[Cs+].[Cs+]",
+]
+
+
+# intermediates which RDKit caches on a molecule and shares between descriptors, paid once per molecule by any
+# descriptor subset (Chi0n/Chi0v cache the atom connectivity values of every Chi descriptor)
+SharedSetup = [Chem.GetDistanceMatrix, rdPartialCharges.ComputeGasteigerCharges, rdMolDescriptors._CalcCrippenContribs,
+               rdMolDescriptors._CalcLabuteASAContribs, rdMolDescriptors._CalcTPSAContribs, rdMolDescriptors.CalcChi0n,
+               rdMolDescriptors.CalcChi0v]
+
+
+def _molecules(smiles_list, warm):
+    mols = [Chem.AddHs(Chem.MolFromSmiles(smiles)) for smiles in smiles_list]
+    if warm:
+        for mol in mols:
+            for func in SharedSetup:
+                func(mol)
+    return mols
+
+
+def _best_time(funcs, smiles_list, repeat, warm):
+    best = None
+    for _ in range(repeat):
+        mols = _molecules(smiles_list, warm)
+        start = time.perf_counter()
+        for mol in mols:
+            for func in funcs:
+                func(mol)
+        elapsed = (time.perf_counter() - start) / len(mols)
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1e6, 2)
+
+
+def measure(smiles_list=None, repeat=3, warm=True):
+    """
+    Time every RDKit descriptor function on a molecule set
+
+    Each descriptor of each repeat is timed on freshly parsed molecules, so that the values cached on the molecule
+    by another descriptor or by a former repeat do not hide its cost. With <warm>, the <SharedSetup> intermediates
+    are computed beforehand: the cost is then the marginal one of the descriptor in a multi-descriptor run, the
+    setup itself is measured separately. Without it, the cost is the cold one of the descriptor computed alone.
+
+    Returns:
+        cost (dict): descriptor name => best mean time per molecule (microsecond)
+        setup (float): best mean time per molecule (microsecond) of <SharedSetup>
+    """
+    smiles_list = smiles_list or DefaultSmiles
+    cost = {name: _best_time([func], smiles_list, repeat, warm) for name, func in Descriptors._descList}
+    return cost, _best_time(SharedSetup, smiles_list, repeat, False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the per-descriptor cost table of RDKit descriptors")
+    parser.add_argument("--output", default=None, help="yaml file to write, e.g., calculator/rdkit_cost.yaml")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cold", action="store_true", help="time each descriptor without the shared setup")
+    args = parser.parse_args()
+
+    cost, setup = measure(repeat=args.repeat, warm=not args.cold)
+    total = sum(cost.values())
+    for name, value in sorted(cost.items(), key=lambda x: x[1], reverse=True)[:20]:
+        print(f"{name:<28}{value:>12.1f} us {100 * value / total:>6.1f} %")
+    print(f"{'total':<28}{total:>12.1f} us")
+    print(f"{'shared setup':<28}{setup:>12.1f} us")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            kind = "cold cost" if args.cold else "marginal cost after the shared setup"
+            f.write(f"# mean time per molecule (microsecond), {kind}, written by benchmark/rdkit_cost.py\n")
+            yaml.safe_dump(cost, f, sort_keys=False)
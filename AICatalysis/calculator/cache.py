@@ -0,0 +1,392 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+from pathlib import Path
+
+from rdkit import Chem
+
+from AICatalysis.calculator.gaussian import OUTFile, FCHKFile
+from AICatalysis.calculator.smiles import canonical
+from AICatalysis.common.constant import ParseCacheDir, ConformerCacheDir
+from AICatalysis.common.error import ParseError
+from AICatalysis.common.file import JsonIO, md5
+from AICatalysis.common.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# bump it whenever the stored fields of a reader change
+CacheVersion = 2
+# bump it whenever the embedding or the optimization of the conformers change
+ConformerCacheVersion = 1
+# number of writes between two rescans of a cache directory, to account for the entries of the other processes
+RescanInterval = 1000
+# an eviction frees the cache down to this fraction of its size limit, so that the next writes do not evict again
+EvictionTarget = 0.9
+
+
+def _atomic_write(file, data: bytes):
+    temp = file.parent / f"_{file.name}.{os.getpid()}.{threading.get_ident()}"
+    with open(temp, "wb") as f:
+        f.write(data)
+    os.replace(temp, file)
+
+
+def _evict(directory, suffix, max_bytes):
+    """
+    Remove the least recently used <suffix> files of <directory> until their total size is below
+    <EvictionTarget> x <max_bytes>, when it exceeds <max_bytes>
+
+    Returns:
+        total (int): size of the remaining files
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # removed by another process meanwhile
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    if total <= max_bytes:
+        return total
+    for _, size, path in sorted(entries):
+        if total <= EvictionTarget * max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+
+class _SizeBudget(object):
+    """
+    Running byte total of the <suffix> files of a cache directory
+
+    The directory is only scanned (and evicted, see <_evict>) at the first write, when the total crosses
+    <max_bytes> and every <RescanInterval> writes, instead of at every write.
+    """
+
+    def __init__(self, directory, suffix, max_bytes):
+        self.directory, self.suffix, self.max_bytes = directory, suffix, max_bytes
+        self.total, self.writes = None, 0
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.writes += 1
+            if self.total is not None:
+                self.total += size
+            if self.total is None or self.total > self.max_bytes or self.writes % RescanInterval == 0:
+                self.total = _evict(self.directory, self.suffix, self.max_bytes)
+
+    def reset(self):
+        with self._lock:
+            self.total = None
+
+
+class ParseCache(object):
+    """
+    Persistent cache of parsed <OUTFile>/<FCHKFile> results
+
+    Each source file has a small pointer (paths/<md5 of the path>.json) which records its size, mtime and content
+    hash, and the parsed fields are pickled into a sidecar named by the content hash (blobs/<hash>-<reader>.pkl).
+    A warm lookup costs one stat of the source plus the two cache reads, the content is only hashed again when the
+    size or mtime changed. Sidecars are evicted in least-recently-used order once <max_bytes> is exceeded. All
+    writes are atomic, so worker processes can share the same cache directory: a cache sent to a worker process
+    is reopened there as the cache of its root shared by that process (<get>).
+
+    """
+    _caches = {}
+    _lock = threading.Lock()
+    readers = {"OUTFile": OUTFile, "FCHKFile": FCHKFile}
+    fields = {"OUTFile": ("input_atoms", "mulliken_charge", "dipole_moment", "homo", "lumo", "homo_index",
+                          "lumo_index", "energy", "level"),
+              "FCHKFile": ("index",)}
+
+    def __init__(self, root=ParseCacheDir, max_bytes=2 * 2 ** 30):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits, self.misses = 0, 0
+        (self.root / "paths").mkdir(parents=True, exist_ok=True)
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+        self._budget = _SizeBudget(self.root / "blobs", ".pkl", max_bytes)
+
+    def __reduce__(self):
+        return self.get, (str(self.root), self.max_bytes)
+
+    @classmethod
+    def get(cls, root=ParseCacheDir, max_bytes=2 * 2 ** 30):
+        """
+        Returns:
+            cache (ParseCache): the cache of <root> shared by the process
+        """
+        key = os.path.abspath(root)
+        with cls._lock:
+            if key not in cls._caches:
+                cls._caches[key] = cls(root, max_bytes)
+            return cls._caches[key]
+
+    def _pointer(self, name):
+        return self.root / "paths" / (md5(os.path.abspath(name)) + ".json")
+
+    def _blob(self, content_hash, reader):
+        return self.root / "blobs" / f"{content_hash}-{reader}-v{CacheVersion}.pkl"
+
+    def _failure(self, content_hash, reader):
+        return self.root / "blobs" / f"{content_hash}-{reader}-v{CacheVersion}.err"
+
+    @staticmethod
+    def content_hash(name, chunk=2 ** 20):
+        h = hashlib.blake2b(digest_size=16)
+        with open(name, "rb") as f:
+            for block in iter(lambda: f.read(chunk), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def read(self, name, reader="OUTFile"):
+        """
+        Return the parsed reader of <name>, from the cache if the file is unchanged
+
+        A file which can not be parsed gets a negative entry keyed by its content hash, so that it is not parsed
+        again until it changes.
+
+        Args:
+            name: Gaussian .out/.fchk file
+            reader: "OUTFile" or "FCHKFile"
+
+        Returns:
+            result: <reader> instance with its fields filled
+
+        Raises:
+            ParseError: <name> can not be parsed, now or in a former run
+        """
+        stat = os.stat(name)
+        pointer_file = self._pointer(name)
+        pointer = JsonIO.read(pointer_file) if pointer_file.exists() else None
+
+        if pointer is not None and pointer["size"] == stat.st_size and pointer["mtime_ns"] == stat.st_mtime_ns:
+            content_hash = pointer["hash"]
+        else:
+            content_hash = self.content_hash(name)
+            pointer = {"path": os.path.abspath(name), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                       "hash": content_hash}
+            _atomic_write(pointer_file, json.dumps(pointer).encode("utf-8"))
+
+        result = self.readers[reader](name)
+        blob = self._blob(content_hash, reader)
+        try:
+            with open(blob, "rb") as f:
+                values = pickle.load(f)
+            os.utime(blob)
+            self.hits += 1
+            metrics.incr("cache.parse.hit")
+        except (OSError, EOFError, pickle.UnpicklingError):
+            failure = self._failure(content_hash, reader)
+            if failure.exists():
+                metrics.incr("cache.parse.negative_hit")
+                raise ParseError(f"{name} can not be parsed (cached): {failure.read_text()}")
+            try:
+                result.read()
+            except Exception as error:
+                message = f"{type(error).__name__}: {error}"
+                _atomic_write(failure, message.encode("utf-8"))
+                metrics.incr("cache.parse.failure")
+                raise ParseError(f"{name} can not be parsed: {message}") from error
+            values = {field: getattr(result, field) for field in self.fields[reader]}
+            data = pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+            _atomic_write(blob, data)
+            self.misses += 1
+            metrics.incr("cache.parse.miss")
+            self._budget.add(len(data))
+            return result
+
+        for field, value in values.items():
+            setattr(result, field, value)
+        return result
+
+    def invalidate(self, names=None):
+        """
+        Drop the cached results of <names>, or the whole cache if <names> is None
+
+        """
+        if names is None:
+            for sub_dir in ("paths", "blobs"):
+                for entry in os.scandir(self.root / sub_dir):
+                    os.remove(entry.path)
+            self._budget.reset()
+            return
+
+        for name in names:
+            pointer_file = self._pointer(name)
+            if not pointer_file.exists():
+                continue
+            content_hash = JsonIO.read(pointer_file)["hash"]
+            for reader in self.readers:
+                self._blob(content_hash, reader).unlink(missing_ok=True)
+                self._failure(content_hash, reader).unlink(missing_ok=True)
+            pointer_file.unlink(missing_ok=True)
+        self._budget.reset()
+
+    def rebuild(self, root, pattern="*.out", reader="OUTFile"):
+        """
+        Invalidate and parse again every <pattern> file under <root>, the files which can not be parsed are
+        logged and skipped
+
+        Returns:
+            names (list): the files found, failed (list): those which can not be parsed
+        """
+        names = sorted(str(name) for name in Path(root).rglob(pattern))
+        self.invalidate(names)
+        failed = []
+        for name in names:
+            try:
+                self.read(name, reader)
+            except ParseError as error:
+                logger.warning(error)
+                failed.append(name)
+        return names, failed
+
+
+class ConformerCache(object):
+    """
+    Persistent cache of embedded and force-field optimized RDKit molecules
+
+    An entry is keyed by the canonical SMILES and by everything the geometry depends on (embedding parameters, random
+    seed, force field), and holds the RDKit binary molecule with all its conformers and their properties
+    (<key>.mol). The SMILES of one structure share the entry, a hit from another SMILES is renumbered to its atom
+    order. As in <ParseCache>, the entries are written atomically and evicted in least-recently-used order beyond
+    <max_bytes>, a concurrent reader sees either a complete entry or a miss. A seed of -1 reuses the geometry which
+    was cached first. As <ParseCache>, it is reopened by <get> in the worker processes it is sent to.
+
+    Examples:
+        >>> cache = ConformerCache.get()
+        >>> rmol = RMolecule._from_smiles("CCO", seed=42, cache=cache)
+    """
+    _caches = {}
+    _lock = threading.Lock()
+
+    def __init__(self, root=ConformerCacheDir, max_bytes=2 ** 30):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits, self.misses = 0, 0
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._budget = _SizeBudget(self.root, ".mol", max_bytes)
+
+    def __reduce__(self):
+        return self.get, (str(self.root), self.max_bytes)
+
+    @classmethod
+    def get(cls, root=ConformerCacheDir, max_bytes=2 ** 30):
+        """
+        Returns:
+            cache (ConformerCache): the cache of <root> shared by the process
+        """
+        key = os.path.abspath(root)
+        with cls._lock:
+            if key not in cls._caches:
+                cls._caches[key] = cls(root, max_bytes)
+            return cls._caches[key]
+
+    def _entry(self, smiles, params):
+        content = json.dumps({"smiles": canonical(smiles), "version": ConformerCacheVersion, **params},
+                             sort_keys=True)
+        return self.root / (hashlib.blake2b(content.encode(), digest_size=16).hexdigest() + ".mol")
+
+    @staticmethod
+    def _renumber(mol, smiles):
+        """
+        Atom order of <smiles> for a molecule cached from another SMILES, None if they do not match
+        """
+        if mol.GetProp("smiles") == smiles:
+            return mol
+        query = Chem.MolFromSmiles(smiles)
+        if query is None:
+            return None
+        if query.GetNumAtoms() != mol.GetNumAtoms():
+            query = Chem.AddHs(query)
+        match = mol.GetSubstructMatch(query, useChirality=True)
+        if len(match) != mol.GetNumAtoms():
+            return None
+        energies = [conformer.GetDoubleProp("energy") if conformer.HasProp("energy") else None
+                    for conformer in mol.GetConformers()]
+        mol = Chem.RenumberAtoms(mol, list(match))
+        for conformer, energy in zip(mol.GetConformers(), energies):
+            if energy is not None:
+                conformer.SetDoubleProp("energy", energy)
+        mol.SetProp("smiles", smiles)
+        return mol
+
+    def fetch(self, smiles, params, embed):
+        """
+        Return the cached molecule of <smiles>, or embed and cache it
+
+        Args:
+            smiles: SMILES of the molecule
+            params: JSON-serializable dict of the parameters which determine the geometry
+            embed: callable without argument which builds the molecule of <smiles> on a miss
+
+        Returns:
+            mol: RDKit molecule with its conformers, in the atom order of <smiles>
+        """
+        entry = self._entry(smiles, params)
+        try:
+            with open(entry, "rb") as f:
+                mol = self._renumber(Chem.Mol(f.read()), smiles)
+        except (OSError, RuntimeError, KeyError):
+            # missing, evicted meanwhile or corrupted entry
+            mol = None
+        if mol is not None:
+            try:
+                os.utime(entry)
+            except FileNotFoundError:
+                pass
+            self.hits += 1
+            metrics.incr("cache.conformer.hit")
+            return mol
+
+        mol = embed()
+        stored = Chem.Mol(mol)
+        stored.SetProp("smiles", smiles)
+        data = stored.ToBinary(Chem.PropertyPickleOptions.AllProps)
+        _atomic_write(entry, data)
+        self.misses += 1
+        metrics.incr("cache.conformer.miss")
+        self._budget.add(len(data))
+        return mol
+
+    def invalidate(self):
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".mol"):
+                os.remove(entry.path)
+        self._budget.reset()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage the Gaussian parse cache")
+    parser.add_argument("command", choices=["invalidate", "rebuild"])
+    parser.add_argument("paths", nargs="*", help="files to invalidate, or directories to rebuild")
+    parser.add_argument("--root", default=ParseCacheDir, help="cache directory")
+    parser.add_argument("--metrics-interval", type=float, default=None,
+                        help="log the metrics every <seconds> of a rebuild, default: no report")
+    parser.add_argument("--metrics-file", default=None, help="JSON file the reported metrics are dumped to")
+    args = parser.parse_args()
+    if args.metrics_interval:
+        logging.basicConfig(level=logging.INFO)
+
+    cache = ParseCache(args.root)
+    if args.command == "invalidate":
+        cache.invalidate(args.paths or None)
+    else:
+        with metrics.reporting(args.metrics_interval, args.metrics_file):
+            for path in args.paths:
+                for pattern, reader in (("*.out", "OUTFile"), ("*.fchk", "FCHKFile")):
+                    names, failed = cache.rebuild(path, pattern, reader)
+                    print(f"{path}: {len(names) - len(failed)}/{len(names)} {pattern} files parsed")
@@ -1,8 +1,9 @@
-import json
+import logging
 import os
+import pickle
 import re
-import subprocess
-from functools import wraps
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial, wraps
 from pathlib import Path
 
 import numpy as np
@@ -11,59 +12,204 @@ from rdkit import Chem
 from rdkit.Chem import Descriptors
 from rdkit.ML.Descriptors import MoleculeDescriptors
 
-from AICatalysis.calculator.gaussian import OUTFile, FCHKFile
+from AICatalysis.calculator.gaussian import OUTFile, LazyOUTFile, FCHKFile
 from AICatalysis.calculator.rbase import RMolecule
-from AICatalysis.calculator.smiles import SmilesFile
+from AICatalysis.calculator.runner import Multiwfn
+from AICatalysis.calculator.smiles import SmilesRegistry
+from AICatalysis.calculator.store import DescriptorStore, store_name, structure_key
 from AICatalysis.common.constant import TotalDesDir, RdkitDesDir, MultiwinDesDir, DescriptorDataDir, \
-    ReactSmilesFile, PCAMulDesDataDir
-from AICatalysis.common.file import JsonIO
+    ReactSmilesFile, PCAMulDesDataDir, PCARdkitDesDataDir, PCATotalDesDataDir, RdkitCostFile
+from AICatalysis.common.error import FileFormatError
+from AICatalysis.common.file import YamlIO
+from AICatalysis.common.metrics import metrics, collected, merge_collected
 from AICatalysis.common.utils import float_
 
+logger = logging.getLogger(__name__)
 
-def print_status(func):
+
+def record_status(func):
+    """
+    Record the wall time of a descriptor write under "descriptor.<class>.write"
+
+    """
     @wraps(func)
     def wrapper(self, *args, **kwargs):
-        result = func(self, *args, **kwargs)
-        print(f"{Path(self.out_name).stem} has saved\n")
+        with metrics.timer(f"descriptor.{type(self).__name__}.write"):
+            result = func(self, *args, **kwargs)
+        logger.debug(f"{Path(self.out_name).stem} has saved")
         return result
 
     return wrapper
 
 
+def _out_to_rmol(out_name):
+    """
+    Convert the input geometry of a Gaussian output to an RDKit molecule in-process
+
+    The total charge is the rounded sum of the Mulliken charges, which constrains the bond order and formal charge
+    perception of <RMolecule._from_atoms>.
+
+    """
+    try:
+        out = LazyOUTFile(out_name).read()
+        _rmol, _ = RMolecule._from_atoms(out.input_atoms, charge=round(sum(out.mulliken_charge)))
+    except (OSError, KeyError, IndexError, ValueError, FileFormatError):
+        return None
+    return _rmol
+
+
+# named RDKit descriptor subsets, "fast" is derived from the measured cost table and includes "minimal"
+RdkitProfiles = {
+    "minimal": ["MolWt", "HeavyAtomCount", "NumValenceElectrons", "MolLogP", "MolMR", "TPSA", "LabuteASA",
+                "NumHDonors", "NumHAcceptors", "NumRotatableBonds", "RingCount", "NumAromaticRings",
+                "FractionCSP3", "NumHeteroatoms"],
+}
+FastCostFactor = 5  # the "fast" profile drops the descriptors costing more than 5x the median one
+
+
+@lru_cache(maxsize=None)
+def rdkit_cost():
+    """
+    Mean time per molecule (microsecond) of every RDKit descriptor, measured by benchmark/rdkit_cost.py
+
+    The times are marginal: the intermediates shared by several descriptors (distance matrix, charges, Crippen and
+    surface contributions, <SharedSetup> there) are computed beforehand, as they are paid once per molecule whatever
+    the descriptor subset.
+
+    """
+    return YamlIO.read(RdkitCostFile)
+
+
+def select_rdkit_descriptors(descriptors="full"):
+    """
+    Resolve a descriptor profile or an explicit list into RDKit descriptor names
+
+    Args:
+        descriptors: "full", "fast", "minimal" or a list of descriptor names
+
+    Returns:
+        names (list): descriptor names, in the order of <Descriptors._descList>
+    """
+    all_names = [x[0] for x in Descriptors._descList]
+    if descriptors is None or descriptors == "full":
+        return all_names
+    elif descriptors == "fast":
+        cost = rdkit_cost()
+        limit = FastCostFactor * float(np.median(list(cost.values())))
+        minimal = set(RdkitProfiles["minimal"])
+        return [name for name in all_names if cost.get(name, 0) <= limit or name in minimal]
+    elif isinstance(descriptors, str):
+        if descriptors not in RdkitProfiles:
+            raise KeyError(f"Unknown descriptor profile <{descriptors}>, use one of full, fast, "
+                           f"{', '.join(RdkitProfiles)} or a list of names")
+        descriptors = RdkitProfiles[descriptors]
+
+    unknown = set(descriptors) - set(all_names)
+    if unknown:
+        raise KeyError(f"Unknown RDKit descriptors: {', '.join(sorted(unknown))}")
+    return [name for name in all_names if name in set(descriptors)]
+
+
+def profile_key(descriptors="full"):
+    """
+    Descriptor subset part of a <structure_key>, None for the full set (whose keys have no profile)
+
+    """
+    if descriptors is None or descriptors == "full":
+        return None
+    if isinstance(descriptors, str):
+        return descriptors
+    return "list:" + ",".join(sorted(descriptors))
+
+
 class Descriptor(object):
     des_type = None
     def __init__(self, out_name):
         self.out_name = out_name
 
+    def level(self):
+        """
+        Returns:
+            level (str): level of theory (method/basis) read from the archive of the output, None if unknown
+        """
+        try:
+            return LazyOUTFile(self.out_name).read().level
+        except (OSError, KeyError, IndexError, ValueError):
+            return None
+
+    def structure_key(self):
+        """
+        Returns:
+            key (str): <structure_key> of the molecule, None if its SMILES or the level of theory is unknown
+        """
+        smiles = getattr(self, "smiles", None)
+        if smiles is None and os.path.exists(ReactSmilesFile):
+            smiles = SmilesRegistry.get(ReactSmilesFile).smiles(Path(self.out_name).stem)
+        level = self.level()
+        if smiles is None or level is None:
+            return None
+        return structure_key(smiles, level, profile_key(getattr(self, "descriptors", "full")))
+
+    @classmethod
+    def write_all(cls, out_names, workers=None, **kwargs):
+        """
+        Write the descriptors of many outputs with a bounded thread pool
+
+        The heavy work runs in external programs, each in its own scratch directory, so the threads do not share
+        any file and the pool can use all the cores of a node. The descriptor stores are saved once at the end.
+
+        """
+        with DescriptorStore.deferred(), ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            list(executor.map(lambda out_name: cls(out_name, **kwargs).write(), out_names))
+
     def calc_descriptor(self):
         pass
 
-    @print_status
+    @record_status
     def write(self):
-        json_path = self.des_type / self.out_name.split('/')[-2] / (Path(self.out_name).stem + '.json')
-        if not os.path.exists(json_path):
-            JsonIO.write(self.calc_descriptor(), json_path)
+        store = DescriptorStore.open(self.des_type)
+        name = store_name(self.out_name)
+        if name in store:
+            return
+        key = self.structure_key()
+        with DescriptorStore.deferred():
+            if key is not None and key in store:
+                # the structure is already computed under another name
+                store.alias([name], key)
+                metrics.incr("descriptor.reused")
+                return
+            with metrics.timer(f"descriptor.{type(self).__name__}.calc"):
+                des = self.calc_descriptor()
+            if des:
+                store.update({name if key is None else key: des})
+                metrics.incr(f"rows.{self.des_type.name}")
+                if key is not None:
+                    store.alias([name], key)
 
 
 class RdkitDescriptor(Descriptor):
     des_type = RdkitDesDir
-    def __init__(self, out_name, smiles=None):
+    def __init__(self, out_name, smiles=None, descriptors="full", cache=None):
         super().__init__(out_name)
         self.smiles = smiles
+        self.descriptors = descriptors
+        self.cache = cache  # <ConformerCache> of the molecules embedded from <smiles>, default: no cache
+
+    def structure_key(self):
+        """
+        Only the descriptors computed from <smiles> are keyed by structure (without level of theory, with the
+        <descriptors> profile), those of the geometry perceived by <_out_to_rmol> may describe another structure
+        and stay keyed by name
+        """
+        return None if self.smiles is None else structure_key(self.smiles, None, profile_key(self.descriptors))
 
     def _convert_rdkit(self):
         if self.smiles is None:
-            process = subprocess.Popen(f"obabel -ig16 {self.out_name} -osdf", stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            content = process.stdout.read().decode(encoding='utf-8')
-            lines = content.splitlines()[:-4]
-            with open("temp.mol", "w") as f:
-                f.write("\n".join(lines))
-            try:
-                _rmol, _ = RMolecule._from_mol_file("temp.mol")
-            except:
+            _rmol = _out_to_rmol(self.out_name)
+            if _rmol is None:
                 return None
         else:
-            _rmol = RMolecule._from_smiles(self.smiles)
+            _rmol = RMolecule._from_smiles(self.smiles, cache=self.cache)
         rmol = RMolecule(_rmol, remove_H=False)
 
         return rmol
@@ -72,11 +218,91 @@ class RdkitDescriptor(Descriptor):
         self._rmol = self._convert_rdkit()
         if self._rmol is None:
             return None
-        nms = [x[0] for x in Descriptors._descList]
+        nms = select_rdkit_descriptors(self.descriptors)
         calc = MoleculeDescriptors.MolecularDescriptorCalculator(nms)
         return dict(zip(nms, calc.CalcDescriptors(self._rmol._rmol)))
 
 
+class RdkitDescriptorBatch(object):
+    """
+    Compute RDKit descriptors of a molecule library chunk-wise in a process pool
+
+    Each worker builds the descriptor calculator once and returns a float32 block, the blocks are stacked into one
+    (molecules x descriptors) matrix with a shared column index. As every descriptor of <Descriptors._descList> is
+    topological, the molecules are not embedded (the values equal those of <RdkitDescriptor> on an embedded
+    molecule). Molecules which can not be parsed get a row of NaN.
+
+    """
+
+    def __init__(self, descriptors="full", workers=None, chunksize=256):
+        self.columns = select_rdkit_descriptors(descriptors)
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.chunksize = chunksize
+        self.index = None
+        self.matrix = None
+
+    def calc(self, molecules, index=None):
+        """
+        Args:
+            molecules: SMILES strings or RDKit molecules
+            index: row names, default: the SMILES (or the row numbers for molecules)
+
+        Returns:
+            self, with the float32 <matrix>, its <columns> and row <index>
+        """
+        molecules = list(molecules)
+        if index is None:
+            index = [item if isinstance(item, str) else str(row) for row, item in enumerate(molecules)]
+        chunks = [molecules[i:i + self.chunksize] for i in range(0, len(molecules), self.chunksize)]
+
+        if self.workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_rdkit_calculator,
+                                     initargs=(self.columns,)) as executor:
+                blocks = merge_collected(executor.map(partial(collected, _calc_rdkit_chunk), chunks))
+        else:
+            _init_rdkit_calculator(self.columns)
+            blocks = [_calc_rdkit_chunk(chunk) for chunk in chunks]
+
+        self.index = list(index)
+        self.matrix = np.vstack(blocks) if blocks else np.empty((0, len(self.columns)), dtype=np.float32)
+        return self
+
+    def to_frame(self):
+        return pd.DataFrame(self.matrix, index=self.index, columns=self.columns)
+
+    def write(self, file):
+        np.savez(file, matrix=self.matrix, columns=np.array(self.columns), index=np.array(self.index))
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as data:
+            batch = cls(descriptors=data["columns"].tolist())
+            batch.matrix, batch.index = data["matrix"], data["index"].tolist()
+        return batch
+
+
+_rdkit_calculator = None
+
+
+def _init_rdkit_calculator(columns):
+    global _rdkit_calculator
+    _rdkit_calculator = MoleculeDescriptors.MolecularDescriptorCalculator(columns)
+
+
+def _calc_rdkit_chunk(molecules):
+    """
+    Worker of <RdkitDescriptorBatch>, one float32 row per molecule
+
+    """
+    block = np.full((len(molecules), len(_rdkit_calculator.GetDescriptorNames())), np.nan, dtype=np.float32)
+    for row, item in enumerate(molecules):
+        rmol = Chem.MolFromSmiles(item) if isinstance(item, str) else item
+        if rmol is None:
+            continue
+        block[row] = np.array(_rdkit_calculator.CalcDescriptors(Chem.AddHs(rmol)), dtype=np.float64)
+    return block
+
+
 class SmilesDescriptor(Descriptor):
     def __init__(self, out_name, smiles=None):
         super().__init__(out_name)
@@ -85,16 +311,10 @@ class SmilesDescriptor(Descriptor):
 
     def calc_descriptor(self):
         if self.smiles is None:
-            process = subprocess.Popen(f"obabel -ig16 {self.out_name} -osdf", stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            content = process.stdout.read().decode(encoding='utf-8')
-            lines = content.splitlines()[:-4]
-            with open("temp.mol", "w") as f:
-                f.write("\n".join(lines))
-            try:
-                _rmol, _ = RMolecule._from_mol_file("temp.mol")
-            except:
+            _rmol = _out_to_rmol(self.out_name)
+            if _rmol is None:
                 return None
-            smiles = Chem.MolToSmiles(_rmol._rmol)
+            smiles = Chem.MolToSmiles(_rmol)
         else:
             smiles = self.smiles
 
@@ -112,19 +332,82 @@ class GaussianDescriptor(Descriptor):
 class MultiwinDescriptor(Descriptor):
     mod = ["WfnSurfESP", "WfnLength", "WfnSurfALIE", "OrbRelated", "EnergyRelated"]
     des_type = MultiwinDesDir
-
-    def __init__(self, out_name):
+    # Multiwfn commands of each analysis, starting from the main menu and going back to it
+    wfn_scripts = {"WfnSurfESP": "12\n0\n-1\n-1\n",
+                   "WfnLength": "100\n21\nsize\n0\nq\n0\n",
+                   "WfnSurfALIE": "12\n2\n2\n0\n-1\n-1\n",
+                   "MullikenBondOrder": "9\n4\n0\n0\n",
+                   "MayerValence": "9\n1\n0\n0\n"}
+    # last line parsed from the log of each analysis, its presence means the analysis is complete
+    wfn_markers = {"WfnSurfESP": " Polar surface area",
+                   "WfnLength": " Length of the three sides:",
+                   "WfnSurfALIE": " Average value:",
+                   "MullikenBondOrder": " If outputting bond order matrix",
+                   "MayerValence": " If outputting bond order matrix"}
+    wfn_main_menu = "Main function menu"
+
+    def __init__(self, out_name, single_session=True):
         super().__init__(out_name)
         self.fchk_name = re.sub(r'\.out', '.fchk', re.sub('out/', 'fchk/',self.out_name))
+        self.single_session = single_session
+        self._wfn_logs = {}
 
 
     def calc_descriptor(self):
-        self._out_gaussian = OUTFile(self.out_name).read()
+        # only the atoms, orbitals and archive energies are used, so the other sections are never parsed
+        self._out_gaussian = LazyOUTFile(self.out_name).read()
+        if self.single_session and Path(self.fchk_name).exists():
+            self._wfn_logs = self.run_session(list(self.wfn_scripts))
         des = {}
         for mod_fun in self.mod:
             des.update(getattr(self, mod_fun)())
         return  des
 
+    def _run_wfn(self, script):
+        return Multiwfn.run([os.path.abspath(self.fchk_name)], stdin=script).splitlines(keepends=True)
+
+    def run_session(self, analyses):
+        """
+        Chain several analyses in one Multiwfn run, so the fchk is loaded and initialized only once
+
+        The combined log is split at each return to the main menu. If the number of returns does not match the
+        chained analyses (e.g., Multiwfn died or an analysis left the menu early), only the leading parts holding
+        the results of their analysis (<wfn_markers>) are kept, the other analyses fall back to their own run.
+
+        Args:
+            analyses: keys of <wfn_scripts>
+
+        Returns:
+            logs (dict): analysis => its part of the log
+        """
+        _content = self._run_wfn("".join(self.wfn_scripts[analysis] for analysis in analyses) + "q")
+
+        menu_index = [index for index, line in enumerate(_content) if self.wfn_main_menu in line]
+        logs = {analysis: _content[start:end] for analysis, start, end in zip(analyses, menu_index, menu_index[1:])}
+        if len(menu_index) == len(analyses) + 1:
+            return logs
+
+        complete = {}
+        for analysis, log in logs.items():
+            # the parts after an incomplete one are no longer aligned with their analysis
+            if not any(line.startswith(self.wfn_markers[analysis]) for line in log):
+                break
+            complete[analysis] = log
+        missing = [analysis for analysis in analyses if analysis not in complete]
+        metrics.incr("multiwfn.session.mismatch")
+        logger.warning(f"Multiwfn session of {self.fchk_name} returned {len(menu_index)} times to the main menu "
+                       f"for {len(analyses)} analyses, rerunning {', '.join(missing)}")
+        return complete
+
+    def wfn_log(self, analysis):
+        """
+        Log of one analysis, taken from the single session if there is one
+
+        """
+        if analysis not in self._wfn_logs:
+            self._wfn_logs[analysis] = self._run_wfn(self.wfn_scripts[analysis] + "q")
+        return self._wfn_logs[analysis]
+
     def WfnSurfESP(self):
         """
         Use Gaussian + Multiwfn method to calculate the molecule surface area && Volume
@@ -133,8 +416,6 @@ class MultiwinDescriptor(Descriptor):
             http://sobereva.com/487, http://sobereva.com/102, http://sobereva.com/159
 
         """
-        cal_log = "log"
-        wfn_config = "config"
         _esp_min, _esp_max = None, None
         _volume = None  # (unit: Angstrom^3)
         _density = None #(unit: g/cm^3)
@@ -146,21 +427,11 @@ class MultiwinDescriptor(Descriptor):
         _nonpolar_surf_area, _polar_surf_area  = None, None # (unit: Angstrom ^2)
         _nonpolar_surf_area_percent, _polar_surf_area_percent = None, None
 
-        out_file = Path(self.out_name)
         fchk_file = self.fchk_name
         if not Path(fchk_file).exists():
             return None
 
-        with open(wfn_config, "w") as f:
-            f.writelines('12\n0\n-1\n-1\nq')
-
-        os.system(f"Multiwfn.exe {fchk_file} < {wfn_config} > {cal_log}")
-
-        with open(cal_log, "r") as f:
-            _content = f.readlines()
-
-        # os.remove(cal_log)
-        # os.remove(wfn_config)
+        _content = self.wfn_log("WfnSurfESP")
 
         for line in _content:
             if line.startswith(' Global surface minimum:'):
@@ -226,25 +497,15 @@ class MultiwinDescriptor(Descriptor):
             http://sobereva.com/426, http://sobereva.com/190
 
         """
-        cal_log = "log"
-        wfn_config = "config"
         _length_x, _length_y, _length_z = None, None, None
         _radius = None
 
-        out_file = Path(self.out_name)
         fchk_file = self.fchk_name
 
         if not Path(fchk_file).exists():
             return None
 
-        with open(wfn_config, "w") as f:
-            f.writelines("100\n21\nsize\n0\nq\n0\nq")
-
-        os.system(f"Multiwfn.exe {fchk_file} < {wfn_config} > {cal_log}")
-
-        with open(cal_log, "r") as f:
-            _content = f.readlines()
-        os.remove(cal_log)
+        _content = self.wfn_log("WfnLength")
 
         for line in _content:
             if line.startswith(' Radius of the system:'):
@@ -259,24 +520,14 @@ class MultiwinDescriptor(Descriptor):
                 'length_z': _length_z}
 
     def WfnSurfALIE(self):
-        cal_log = "log"
-        wfn_config = "config"
         _ALIE = None # (unit: a. u.)
 
-        out_file = Path(self.out_name)
         fchk_file = self.fchk_name
 
         if not Path(fchk_file).exists():
             return None
 
-        with open(wfn_config, "w") as f:
-            f.writelines("12\n2\n2\n0\n-1\n-1\nq")
-
-        os.system(f"Multiwfn.exe {fchk_file} < {wfn_config} > {cal_log}")
-
-        with open(cal_log, "r") as f:
-            _content = f.readlines()
-        os.remove(cal_log)
+        _content = self.wfn_log("WfnSurfALIE")
 
         for line in _content:
             if line.startswith(' Average value:'):
@@ -300,24 +551,13 @@ class MultiwinDescriptor(Descriptor):
         # calculate Fukui-related
         fchk = FCHKFile(fchk_file).read()
 
-        coeff_homo = fchk.coeff[self._out_gaussian.homo_index]
-        coeff_lumo = fchk.coeff[self._out_gaussian.lumo_index]
+        coeff_homo, coeff_lumo = fchk.mo_coefficients([self._out_gaussian.homo_index, self._out_gaussian.lumo_index])
         Fukui_nucleophilic = np.sum(coeff_homo ** 2) / (1 - homo)
         Fukui_electrophilic = np.sum(coeff_lumo ** 2) / (lumo + 10)
         Fukui_one_electron = np.sum(np.kron(coeff_homo, coeff_lumo)) / (lumo - homo)
 
         # calculate Mulliken Bond Order
-        cal_log = "log"
-        wfn_config = "config"
-
-        with open(wfn_config, "w") as f:
-            f.writelines("9\n4\n0\n0\nq")
-
-        os.system(f"Multiwfn.exe {fchk_file} < {wfn_config} > {cal_log}")
-
-        with open(cal_log, "r") as f:
-            _content = f.readlines()
-        os.remove(cal_log)
+        _content = self.wfn_log("MullikenBondOrder")
 
         lns, lne = -1, 0
         for index, line in enumerate(_content):
@@ -331,14 +571,7 @@ class MultiwinDescriptor(Descriptor):
         avg_bond_order = sum(bond_order) / len(bond_order)
 
         # calculate Total and Free Valence
-        with open(wfn_config, "w") as f:
-            f.writelines("9\n1\n0\n0\nq")
-
-        os.system(f"Multiwfn.exe {fchk_file} < {wfn_config} > {cal_log}")
-
-        with open(cal_log, "r") as f:
-            _content = f.readlines()
-        os.remove(cal_log)
+        _content = self.wfn_log("MayerValence")
 
         lns, lne = -1, 0
         for index, line in enumerate(_content):
@@ -373,110 +606,245 @@ class MultiwinDescriptor(Descriptor):
 class TotalDescriptor(Descriptor):
     des_type = TotalDesDir
 
-    def __init__(self, out_name):
+    def __init__(self, out_name, descriptors="full"):
         super().__init__(out_name)
+        self.descriptors = descriptors
 
     def calc_descriptor(self):
-        rdkit_des_path = RdkitDesDir / self.out_name.split('/')[-2] / (Path(self.out_name).stem + '.json')
-        #如果没有对应的描述符文件，就生成一个
-        if not os.path.exists(rdkit_des_path):
-            reaction_smiles = SmilesFile(ReactSmilesFile)
-            if Path(self.out_name).stem in reaction_smiles.file_name.values:
-                smiles = reaction_smiles.smiles[reaction_smiles.file_name == Path(self.out_name).stem].values[0]
-                rdkit_descriptor = RdkitDescriptor(self.out_name, smiles=smiles)
+        name = store_name(self.out_name)
+        rdkit_store, multiwin_store = DescriptorStore.open(RdkitDesDir), DescriptorStore.open(MultiwinDesDir)
+        #如果没有对应的描述符，就生成一个
+        if name not in rdkit_store:
+            smiles = SmilesRegistry.get(ReactSmilesFile).smiles(Path(self.out_name).stem)
+            if smiles is not None:
+                rdkit_descriptor = RdkitDescriptor(self.out_name, smiles=smiles, descriptors=self.descriptors)
             else:
-                rdkit_descriptor = RdkitDescriptor(self.out_name)
+                rdkit_descriptor = RdkitDescriptor(self.out_name, descriptors=self.descriptors)
             rdkit_descriptor.write()
-        multiwin_des_path = MultiwinDesDir / self.out_name.split('/')[-2] / (Path(self.out_name).stem + '.json')
-        # 如果没有对应的描述符文件，就生成一个
-        if not os.path.exists(multiwin_des_path):
+        # 如果没有对应的描述符，就生成一个
+        if name not in multiwin_store:
             multiwin_descriptor = MultiwinDescriptor(self.out_name)
             multiwin_descriptor.write()
-        try:
-            des = JsonIO.read(rdkit_des_path) | JsonIO.read(multiwin_des_path)
-        except TypeError:
-            #其中一类描述符为空
-            des = JsonIO.read(rdkit_des_path) if JsonIO.read(rdkit_des_path) else JsonIO.read(multiwin_des_path)
-        return des
+        #其中一类描述符可能为空
+        des = (rdkit_store.get(name) or {}) | (multiwin_store.get(name) or {})
+        return des or None
 
 class DescriptorDatabase:
+    """
+    Descriptors of one chemical type, with a persisted standardization + PCA projection
+
+    The fitted scaler and PCA are pickled next to the descriptor store (<des_type>.<chemical>.pca.pkl) and reused
+    by every instance, <update> only projects the molecules with the fitted model, the model is fitted again only
+    by <refit>, when no model exists yet or when the stored model was fitted with other parameters.
+
+    Args:
+        chemical_type: e.g., "ligand"
+        n_components: number of components, or the explained variance ratio to keep (float, "full" solver only)
+        solver: "full", "randomized" (large tables) or "incremental" (fitted by <batch_size> rows, which bounds the
+            memory of the decomposition, not that of the table: <data> and the descriptor store are in memory)
+    """
     des_type = None
-    def __init__(self, chemical_type):
+    pca_type = PCAMulDesDataDir
+    solvers = ("full", "randomized", "incremental")
+
+    def __init__(self, chemical_type, n_components=2, solver="full", batch_size=1024):
+        if solver not in self.solvers:
+            raise ValueError(f"Unknown PCA solver <{solver}>, use one of {', '.join(self.solvers)}")
+        if isinstance(n_components, float) and not isinstance(n_components, bool):
+            if not 0 < n_components < 1:
+                raise ValueError(f"A variance ratio <n_components> must be in (0, 1), got {n_components}")
+            if solver != "full":
+                raise ValueError(f"A variance ratio <n_components> needs the full solver, got {solver}, "
+                                 f"give a number of components instead")
+        elif not isinstance(n_components, (int, np.integer)) or isinstance(n_components, bool) or n_components < 1:
+            raise ValueError(f"<n_components> must be a positive int or a float in (0, 1), got {n_components!r}")
+        if solver == "incremental" and batch_size < n_components:
+            raise ValueError(f"<batch_size> ({batch_size}) must not be smaller than <n_components> ({n_components})")
         self.chemical_des_dir = self.des_type / chemical_type
-        self.data = self.read_json()
-        self.pca_data = self.pca()
-
-    def read_json(self):
-        data_dict = {}
-
-        for filename in os.listdir(self.chemical_des_dir):
-            if filename.endswith('.json'):
-                with open(os.path.join(self.chemical_des_dir, filename)) as f:
-                    data_dict[os.path.splitext(filename)[0]] = json.load(f)
-
-        try:
-            df = pd.DataFrame.from_dict(data_dict, orient='index')
-        except:
-            df = pd.DataFrame(data_dict).transpose()
+        self.store = DescriptorStore.open(self.des_type)
+        self.model_file = Path(f"{self.des_type}.{chemical_type}.pca.pkl")
+        self.n_components, self.solver, self.batch_size = n_components, solver, batch_size
+        self.data = self.read()
+        self._model = None
+        self._pca_data = None
+
+    def read(self):
+        df = self.store.frame(chemical=self.chemical_des_dir.name).astype(np.float64)
         df.loc['nan'] = np.zeros(df.shape[1])
         df.fillna(0, inplace=True)
         return df
 
-    def pca(self, thresh=0.9):
+    @property
+    def params(self):
+        """
+        Returns:
+            params (dict): the parameters the model is fitted with
+        """
+        return {"n_components": self.n_components, "solver": self.solver,
+                "batch_size": self.batch_size if self.solver == "incremental" else None}
+
+    def _load_model(self):
+        if not self.model_file.exists():
+            return None
+        with open(self.model_file, 'rb') as f:
+            return pickle.load(f)
+
+    @property
+    def model(self):
+        if self._model is None:
+            model = self._load_model()
+            if model is not None and model.get("params") != self.params:
+                logger.warning(f"{self.model_file} was fitted with {model.get('params')}, refit with {self.params}")
+                model = None
+            if model is None:
+                self._model = self._fit()
+                self._save_model()
+            else:
+                self._model = model
+        return self._model
+
+    @property
+    def pca_data(self):
+        if self._pca_data is None:
+            self._pca_data = self.transform(self.data)
+        return self._pca_data
+
+    def _fit(self):
         from sklearn.preprocessing import StandardScaler
-        from sklearn.decomposition import PCA
+        from sklearn.decomposition import PCA, IncrementalPCA
 
+        values = self.data.values
         scaler = StandardScaler()
-        self.data.iloc[:, :] = scaler.fit_transform(self.data.iloc[:, :])
-        pca = PCA()
-        pca.fit(self.data.values)
-        cumsum = np.cumsum(pca.explained_variance_ratio_)
-        d = np.argmax(cumsum >= thresh) + 1
-        pca = PCA(n_components=2)
-        return pd.DataFrame(pca.fit_transform(self.data), index=self.data.index)
+        if self.solver == "incremental":
+            batches = [values[i:i + self.batch_size] for i in range(0, len(values), self.batch_size)]
+            for batch in batches:
+                scaler.partial_fit(batch)
+            pca = IncrementalPCA(n_components=self.n_components)
+            for batch in batches:
+                if len(batch) >= self.n_components:
+                    pca.partial_fit(scaler.transform(batch))
+        else:
+            pca = PCA(n_components=self.n_components, svd_solver=self.solver, random_state=0)
+            pca.fit(scaler.fit_transform(values))
+        return {"columns": list(self.data.columns), "scaler": scaler, "pca": pca, "solver": self.solver,
+                "params": self.params}
+
+    def _save_model(self):
+        temp = self.model_file.parent / f"_{self.model_file.name}.{os.getpid()}"
+        with open(temp, 'wb') as f:
+            pickle.dump(self._model, f)
+        os.replace(temp, self.model_file)
+
+    def transform(self, data):
+        """
+        Project descriptors with the fitted model, the descriptors unknown to the model are ignored and the missing
+        ones are 0
+
+        """
+        model = self.model
+        values = data.reindex(columns=model["columns"], fill_value=0).values
+        return pd.DataFrame(model["pca"].transform(model["scaler"].transform(values)), index=data.index)
+
+    def pca(self):
+        return self.pca_data
+
+    def refit(self):
+        """
+        Fit the scaler and PCA again on the current <data> and persist them
 
+        Returns:
+            drift (DataFrame): per component, 1 - |cos| between the former and the new axis (0: unchanged,
+                1: orthogonal) and both explained variance ratios, empty if there was no former model
+        """
+        former = self._load_model()
+        self._model = self._fit()
+        self._save_model()
+        self._pca_data = None
+
+        if former is None:
+            return pd.DataFrame(columns=["drift", "former_variance_ratio", "variance_ratio"])
+        columns = self._model["columns"]
+        old = pd.DataFrame(former["pca"].components_, columns=former["columns"]).reindex(columns=columns,
+                                                                                          fill_value=0).values
+        new = self._model["pca"].components_
+        num = min(len(old), len(new))
+        cos = np.abs(np.sum(old[:num] * new[:num], axis=1)) / (np.linalg.norm(old[:num], axis=1) *
+                                                                 np.linalg.norm(new[:num], axis=1))
+        return pd.DataFrame({"drift": 1 - cos,
+                             "former_variance_ratio": former["pca"].explained_variance_ratio_[:num],
+                             "variance_ratio": self._model["pca"].explained_variance_ratio_[:num]})
 
     def concat(self):
-        des_list = []
-        des_files = [os.path.join(self.chemical_des_dir, file) for file in os.listdir(self.chemical_des_dir)]
-        for des_file in des_files:
-            des_list.append(JsonIO.read(des_file))
-        return des_list
+        prefix = self.chemical_des_dir.name + '/'
+        return [self.store.get(name) for name in self.store.names if name.startswith(prefix)]
 
-    def update(self):
-        pass
+    def update(self, records):
+        """
+        Append or replace molecules of this chemical type, then project them with the fitted model (no refit)
+
+        Args:
+            records: {stem: {descriptor: value}} or a DataFrame indexed by stem
+        """
+        if isinstance(records, pd.DataFrame):
+            records = records.to_dict(orient='index')
+        self.store.update({f"{self.chemical_des_dir.name}/{stem}": des for stem, des in records.items()})
+        self.data = self.read()
+        self._pca_data = None
 
     def write_csv(self):
         write_file = DescriptorDataDir / (self.chemical_des_dir.stem + '_' + self.des_type.stem + '.csv')
         self.pca_data.to_csv(write_file)
 
-    def write_json(self):
-        for index, row in self.pca_data.iterrows():
-            json_data = row.to_json()
-            with open(PCAMulDesDataDir / self.chemical_des_dir.stem / f"{index}.json", "w") as file:
-                file.write(json_data)
+    def write_pca(self):
+        pca_data = self.pca_data.copy()
+        pca_data.index = [f"{self.chemical_des_dir.name}/{index}" for index in pca_data.index]
+        pca_data.columns = [str(column) for column in pca_data.columns]
+        DescriptorStore.open(self.pca_type).update(pca_data)
 
 
 class RdkitDescriptorDatabase(DescriptorDatabase):
     des_type = RdkitDesDir
+    pca_type = PCARdkitDesDataDir
 
-    def __init__(self, chemical_type):
-        super().__init__(chemical_type)
+    def __init__(self, chemical_type, **kwargs):
+        super().__init__(chemical_type, **kwargs)
 
 
 class MultiwinDescriptorDatabase(DescriptorDatabase):
     des_type = MultiwinDesDir
 
-    def __init__(self, chemical_type):
-        super().__init__(chemical_type)
+    def __init__(self, chemical_type, **kwargs):
+        super().__init__(chemical_type, **kwargs)
 
 
 class TotalDescriptorDatabase(DescriptorDatabase):
     des_type = TotalDesDir
+    pca_type = PCATotalDesDataDir
+
+    def __init__(self, chemical_type, **kwargs):
+        super().__init__(chemical_type, **kwargs)
+
+
+DescriptorDatabases = {"rdkit": RdkitDescriptorDatabase, "multiwin": MultiwinDescriptorDatabase,
+                       "total": TotalDescriptorDatabase}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="refit the PCA of a descriptor database and report the drift")
+    parser.add_argument("command", choices=["refit"])
+    parser.add_argument("family", choices=list(DescriptorDatabases))
+    parser.add_argument("chemical_type")
+    parser.add_argument("--n-components", type=float, default=2)
+    parser.add_argument("--solver", choices=DescriptorDatabase.solvers, default="full")
+    args = parser.parse_args()
 
-    def __init__(self, chemical_type):
-        super().__init__(chemical_type)
+    n_components = int(args.n_components) if args.n_components >= 1 else args.n_components
+    database = DescriptorDatabases[args.family](args.chemical_type, n_components=n_components, solver=args.solver)
+    print(database.refit().to_string())
+    database.write_pca()
 
 
 if __name__ == '__main__':
-    pass
\ No newline at end of file
+    main()
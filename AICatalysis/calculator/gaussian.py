@@ -1,51 +1,158 @@
-import subprocess
+import copy
+import logging
+import mmap
 import re
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from rdkit import Chem
 from rdkit.Chem import AllChem
 
 import numpy as np
 
+from AICatalysis.common.error import FileFormatError, StructureError
+from AICatalysis.common.file import JsonIO
+from AICatalysis.common.metrics import metrics, collected, merge_collected
+
+logger = logging.getLogger(__name__)
+
+_ARCHIVE_START = ' ----------------------------------------------------------------------'
+_ENERGY_KEYWORDS = {'HF', 'ZeroPoint', 'Thermal', 'ETot', 'HTot', 'GTot'}
+_SECTION_HEADERS = (" Symbolic Z-matrix", " Mulliken charges", " Dipole moment", " The electronic state",
+                    " Unable to determine electronic state:")
+_ARCHIVE_START_B = _ARCHIVE_START.encode()
+_SECTION_HEADERS_B = tuple(header.encode() for header in _SECTION_HEADERS)
+_FCHK_HEADER = re.compile(rb"([A-Za-z].{39}) {3}([IRCL]) {3}(N=)?[ \t]*(\S+)[ \t]*\r?\n")
+# 1\1\<host>\<job type>\<method>\<basis>\ at the beginning of the archive block
+_ARCHIVE_LEVEL = re.compile(r"1\\1\\[^\\]*\\[^\\]*\\([^\\]+)\\([^\\]+)\\")
+
+DefaultKeyword = "opt freq=noraman nmr pop=nboread b3lyp/def2tzvp int(grid=ultrafine)"
+
+
+def route_level(route):
+    """
+    Level of theory of a Gaussian route, e.g., "opt b3lyp/def2tzvp int(grid=ultrafine)" => "b3lyp/def2tzvp"
+
+    Returns:
+        level (str): lower-case method/basis, None if the route has no method/basis token
+    """
+    for token in route.replace("#", " ").split():
+        method, _, basis = token.partition("/")
+        if basis and "=" not in method and "(" not in method:
+            return f"{method}/{basis}".lower()
+    return None
+
+
+# level of theory of the gjf files written with the default keyword
+DefaultLevel = route_level(DefaultKeyword)
+
 
 class Gaussian(object):
     pass
 
 
 class GJFFile(object):
-    def __init__(self, keyword="opt freq=noraman nmr pop=nboread b3lyp/def2tzvp int(grid=ultrafine)"):
+    def __init__(self, keyword=DefaultKeyword,
+                 nproc=48, mem="20GB", num_confs=50, prune_rms=0.5, num_threads=0, random_seed=42, cache=None):
         self.keyword = keyword
+        self.nproc = nproc
+        self.mem = mem
+        self.num_confs = num_confs
+        self.prune_rms = prune_rms
+        self.num_threads = num_threads  # 0 means all cores
+        self.random_seed = random_seed
+        self.cache = cache  # <ConformerCache> reused across runs, default: no cache
 
     def read(self):
         pass
 
-    def write(self, smiles: str, file_path, name):
+    def embed(self, smiles: str):
+        """
+        Embed <num_confs> conformers (pruned by RMSD) and optimize them, both multithreaded, or take them from
+        <cache>, see <RMolecule._embed_conformers>
 
-        sdf_path = os.path.join(file_path, name + '.sdf')
-        gjf_path = os.path.join(file_path, name + '.gjf')
+        Returns:
+            mol: RDKit molecule with explicit Hs
+            conf_id: id of the lowest-energy conformer, of the first one when no force field applies
+        """
+        if self.cache is None:
+            mol = self._embed(smiles)
+        else:
+            params = {"method": "ETKDGv3/MMFF-UFF", "num_confs": self.num_confs, "prune_rms": self.prune_rms,
+                      "seed": self.random_seed, "max_iters": 500}
+            mol = self.cache.fetch(smiles, params, partial(self._embed, smiles))
+        optimized = [conformer for conformer in mol.GetConformers() if conformer.HasProp("energy")]
+        if not optimized:
+            logger.warning(f"no force field applies to {smiles}, its first unoptimized conformer is written")
+            return mol, mol.GetConformer().GetId()
+        return mol, min(optimized, key=lambda conformer: conformer.GetDoubleProp("energy")).GetId()
+
+    def _embed(self, smiles):
+        from AICatalysis.calculator.rbase import RMolecule
 
         mol = Chem.MolFromSmiles(smiles)
-        mol = AllChem.AddHs(mol)
-        AllChem.EmbedMultipleConfs(mol, numConfs=50)
-        AllChem.MMFFOptimizeMoleculeConfs(mol, maxIters=500)
-        Chem.MolToMolFile(mol, sdf_path)
-        os.system(f'obabel {sdf_path} -isdf -ogjf -O {gjf_path}')
-        os.remove(sdf_path)
+        if mol is None:
+            raise StructureError(f"{smiles} is not a valid SMILES")
+        return RMolecule._embed_conformers(AllChem.AddHs(mol), self.num_confs, self.random_seed, self.num_threads,
+                                           max_iters=500, prune_rms=self.prune_rms)
+
+    def to_string(self, mol, name, conf_id=-1):
+        charge = Chem.GetFormalCharge(mol)
+        multiplicity = sum(atom.GetNumRadicalElectrons() for atom in mol.GetAtoms()) + 1
+        positions = mol.GetConformer(conf_id).GetPositions()
+
+        lines = [f"%nprocshared={self.nproc}", f"%mem={self.mem}", f"%chk={name}.chk", f"# {self.keyword}", "",
+                 name, "", f"{charge} {multiplicity}"]
+        lines.extend(f"{atom.GetSymbol():<2}{x:>16.8f}{y:>16.8f}{z:>16.8f}"
+                     for atom, (x, y, z) in zip(mol.GetAtoms(), positions))
+        lines.extend(["", "$nbo bndidx $end", ""])
+        return "\n".join(lines)
 
-        with open(gjf_path, 'r', encoding='utf-8') as f_gjf:
-            text = f_gjf.readlines()
+    def write(self, smiles: str, file_path, name):
+        """
+        Write <file_path>/<name>.gjf from the lowest-energy conformer of <smiles>, without any external process
+
+        """
+        mol, conf_id = self.embed(smiles)
+        with open(os.path.join(file_path, name + '.gjf'), 'w', encoding='utf-8') as f_gjf:
+            f_gjf.write(self.to_string(mol, name, conf_id))
+
+    def write_batch(self, smiles_list, name_list, file_path, workers=1):
+        """
+        Write one gjf per (smiles, name), the molecules which can not be embedded are skipped
+
+        Args:
+            smiles_list: SMILES of the molecules
+            name_list: gjf names
+            file_path: output directory
+            workers: number of processes, each one embeds with a single thread when > 1
 
-            text[0] = '%nprocshared=48\n'
-            text[1] = '%mem=20GB\n'
-            text[2] = f'%chk={name}.chk\n'
-            text[3] = f'# {self.keyword}\n'
-            text[4] = '\n'
-            text.insert(5, Path(sdf_path).stem + '\n')
-            text.insert(6, '\n')
-            text.append('$nbo bndidx $end\n')
+        Returns:
+            failed (list): names of the skipped molecules
+        """
+        if workers > 1:
+            gjf = copy.copy(self)
+            gjf.num_threads = 1
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                names = merge_collected(executor.map(partial(collected, _write_gjf, gjf, file_path=file_path),
+                                                     smiles_list, name_list, chunksize=8))
+        else:
+            names = [_write_gjf(self, smiles, name, file_path) for smiles, name in zip(smiles_list, name_list)]
+        return [name for name in names if name is not None]
 
-        with open(gjf_path, 'w', encoding='utf-8') as f_gjf:
-            f_gjf.writelines(text)
+
+def _write_gjf(gjf, smiles, name, file_path):
+    """
+    Worker of <GJFFile.write_batch>, return <name> if the molecule is skipped
+
+    """
+    try:
+        gjf.write(smiles, file_path, name)
+    except StructureError as error:
+        logger.warning(f"{name} ({smiles}) is skipped: {error}")
+        return name
 
 
 class OUTFile(object):
@@ -57,96 +164,449 @@ class OUTFile(object):
         self.homo, self.lumo = None, None
         self.homo_index, self.lumo_index = None, None
         self.energy = None
+        self.level = None
 
+    @metrics.timed("parse.out")
     def read(self):
+        """
+        Parse the Gaussian output in one forward pass
+
+        The log is streamed line by line and each section is consumed by its own reader as soon as its header is
+        met, so the memory is bounded by the largest section (Z-matrix, orbital window or archive block) instead of
+        the whole file. As before, the Z-matrix is taken from its first occurrence, while the other sections keep
+        their last occurrence.
+
+        """
+        archive, orbitals = None, {}
+
         with open(self.name, "r") as f:
-            self._strings = f.readlines()
-
-        # read input_atoms
-        lns, lne = None, None
-        for index, line in enumerate(self._strings):
-            if line.startswith(" Symbolic Z-matrix"):
-                lns = index
-            elif line.startswith(" GradGrad") or line.startswith(" Add virtual"):
-                lne = index
-            if lns is not None and lne is not None:
-                break
+            for line in f:
+                if archive is not None:
+                    archive.append(line)
+                if line.startswith(_ARCHIVE_START):
+                    archive = [line]
+                elif line.endswith('@\n') and archive is not None:
+                    self.energy = self._parse_energy(archive)
+                    self.level = self._parse_level(archive)
+                    archive = None
 
-        _format = lambda x: [str(x[0]), float(x[1]), float(x[2]), float(x[3])]
-        atom_lines = [l.split() for l in self._strings[lns + 2:lne - 2]]
-        self.input_atoms = list(map(_format, atom_lines))
-
-        # read Mulliken charges
-        mulliken_index = [index for index, line in enumerate(self._strings)
-                          if line.startswith(" Mulliken charges:") or
-                          line.startswith(" Mulliken charges and spin densities:")]
-        mulliken_charge = self._strings[mulliken_index[-1] + 2:mulliken_index[-1] + 2 + len(self.input_atoms)]
-        self.mulliken_charge = [float(line.split()[2]) for line in mulliken_charge]
-
-        # read Dipole moment
-        dipole_index = [index for index, line in enumerate(self._strings) if line.startswith(" Dipole moment")][-1] + 1
-        dipole_moment = list(map(float, self._strings[dipole_index].split()[1::2]))
-        self.dipole_moment = {"X": dipole_moment[0], "Y": dipole_moment[1], "Z": dipole_moment[2],
-                              "Tot": dipole_moment[3]}
-
-        # read HOMO/LUMO
-        try:
-            orb_s_index = [index for index, line in enumerate(self._strings)
-                           if line.startswith(" The electronic state")][-1] + 1
-        except:
-            orb_s_index = [index for index, line in enumerate(self._strings)
-                           if line.startswith(" Unable to determine electronic state:")][-1] + 1
-        orb_e_index = [index for index, line in enumerate(self._strings) if
-                       line.startswith("          Condensed to atoms")][-1]
-        orbital_occ = list(map(float,
-                               [item for line in self._strings[orb_s_index:orb_e_index] if "occ." in line
-                                for item in re.sub('-', ' ', line.split("--")[1]).split()]))
-        orbital_virt = list(map(float,
-                                [item for line in self._strings[orb_s_index:orb_e_index] if "virt." in line
-                                 for item in line.split("--")[1].split()]))
+                if not line.startswith(_SECTION_HEADERS):
+                    continue
+                elif line.startswith(" Symbolic Z-matrix"):
+                    if self.input_atoms is None:
+                        self.input_atoms = self._read_zmatrix(f)
+                elif line.startswith(" Mulliken charges:") or line.startswith(" Mulliken charges and spin densities:"):
+                    self.mulliken_charge = self._read_mulliken(f, len(self.input_atoms))
+                elif line.startswith(" Dipole moment"):
+                    self.dipole_moment = self._read_dipole(f)
+                elif line.startswith(" The electronic state"):
+                    orbitals["state"] = self._read_orbitals(f)
+                elif line.startswith(" Unable to determine electronic state:"):
+                    orbitals["unable"] = self._read_orbitals(f)
+
+        # as in the former reader, the assigned electronic state is preferred over the undetermined one
+        orbital_occ, orbital_virt = orbitals["state"] if "state" in orbitals else orbitals["unable"]
         self.homo, self.homo_index = -orbital_occ[-1], len(orbital_occ) - 1
         self.lumo, self.lumo_index = orbital_virt[0], len(orbital_occ)
 
-        # read energy
-        out_s_index = [index for index, line in enumerate(self._strings) if
-                       line.startswith(' ----------------------------------------------------------------------')][-1]
-        out_e_index = [index for index, line in enumerate(self._strings) if line.endswith('@\n')][-1]
-        energy = "".join(self._strings[out_s_index:out_e_index + 1]).replace('\n', '').replace(' ', '').split('\\')
-        keywords = {'HF', 'ZeroPoint', 'Thermal', 'ETot', 'HTot', 'GTot'}
-        energy = {line.split("=")[0]: float(line.split("=")[1]) for line in energy if line.split("=")[0] in keywords}
-        self.energy = energy
+        return self
+
+    @staticmethod
+    def _read_zmatrix(lines):
+        zmatrix = []
+        for line in lines:
+            if line.startswith(" GradGrad") or line.startswith(" Add virtual"):
+                break
+            zmatrix.append(line)
+
+        _format = lambda x: [str(x[0]), float(x[1]), float(x[2]), float(x[3])]
+        return [_format(line.split()) for line in zmatrix[1:-2]]
+
+    @staticmethod
+    def _read_mulliken(lines, num_atoms):
+        next(lines)
+        return [float(next(lines).split()[2]) for _ in range(num_atoms)]
+
+    @staticmethod
+    def _read_dipole(lines):
+        dipole_moment = list(map(float, next(lines).split()[1::2]))
+        return {"X": dipole_moment[0], "Y": dipole_moment[1], "Z": dipole_moment[2], "Tot": dipole_moment[3]}
+
+    @staticmethod
+    def _read_orbitals(lines):
+        occ, virt = [], []
+        for line in lines:
+            if line.startswith("          Condensed to atoms"):
+                break
+            elif "occ." in line:
+                occ.extend(map(float, re.sub('-', ' ', line.split("--")[1]).split()))
+            elif "virt." in line:
+                virt.extend(map(float, line.split("--")[1].split()))
+        return occ, virt
+
+    @staticmethod
+    def _parse_energy(archive):
+        energy = "".join(archive).replace('\n', '').replace(' ', '').split('\\')
+        return {item.split("=")[0]: float(item.split("=")[1]) for item in energy
+                if item.split("=")[0] in _ENERGY_KEYWORDS}
+
+    @staticmethod
+    def _parse_level(archive):
+        """
+        Level of theory (method/basis) of the archive block, in the form of <route_level>, None if it is not found
+
+        """
+        match = _ARCHIVE_LEVEL.search("".join(archive).replace('\n', '').replace(' ', ''))
+        if match is None:
+            return None
+        method, basis = match.groups()
+        # the archive prefixes the closed-shell methods with R (RB3LYP for b3lyp), U and RO are kept
+        if method.startswith("R") and not method.startswith("RO"):
+            method = method[1:]
+        return f"{method}/{basis}".lower()
+
 
+class LazyOUTFile(OUTFile):
+    """
+    Section-indexed <OUTFile>, each field is parsed from its own section on first access
+
+    <read> only locates the byte offsets of the section headers. The index is stored next to the output
+    (e.g., result.out.idx) and reused as long as the size and mtime of the output are unchanged.
+
+    """
+
+    def __init__(self, name="result.out"):
+        self.name = name
+        self.index_name = f"{name}.idx"
+        self._index = None
+        self._fields = {}
+
+    @metrics.timed("parse.out_index")
+    def read(self):
+        stat = os.stat(self.name)
+        if os.path.exists(self.index_name):
+            index = JsonIO.read(self.index_name)
+            if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime:
+                self._index = index["sections"]
+                return self
+
+        self._index = self._build_index()
+        try:
+            JsonIO.write({"size": stat.st_size, "mtime": stat.st_mtime, "sections": self._index}, self.index_name)
+        except OSError:
+            pass
         return self
 
+    def _build_index(self):
+        sections, offset, dash = {}, 0, None
+        with open(self.name, "rb") as f:
+            for line in f:
+                if line.startswith(_ARCHIVE_START_B):
+                    dash = offset
+                elif dash is not None and line.rstrip(b'\r\n').endswith(b'@'):
+                    sections["archive"] = dash
+                elif line.startswith(_SECTION_HEADERS_B):
+                    if line.startswith(b" Symbolic Z-matrix"):
+                        sections.setdefault("zmatrix", offset)
+                    elif line.startswith(b" Mulliken charges:") or \
+                            line.startswith(b" Mulliken charges and spin densities:"):
+                        sections["mulliken"] = offset
+                    elif line.startswith(b" Dipole moment"):
+                        sections["dipole"] = offset
+                    elif line.startswith(b" The electronic state"):
+                        sections["state"] = offset
+                    elif line.startswith(b" Unable to determine electronic state:"):
+                        sections["unable"] = offset
+                offset += len(line)
+        return sections
+
+    def _section(self, key):
+        """
+        Open the output and yield its lines from the <key> section header (excluded)
+
+        """
+        with open(self.name, "r") as f:
+            f.seek(self._index[key])
+            f.readline()
+            yield from iter(f.readline, '')
+
+    def _field(self, key):
+        if key not in self._fields:
+            if self._index is None:
+                self.read()
+
+            if key == "input_atoms":
+                self._fields[key] = self._read_zmatrix(self._section("zmatrix"))
+            elif key == "mulliken_charge":
+                self._fields[key] = self._read_mulliken(self._section("mulliken"), len(self.input_atoms))
+            elif key == "dipole_moment":
+                self._fields[key] = self._read_dipole(self._section("dipole"))
+            elif key in ("energy", "level"):
+                archive = []
+                with open(self.name, "r") as f:
+                    f.seek(self._index["archive"])
+                    for line in f:
+                        archive.append(line)
+                        if line.endswith('@\n'):
+                            break
+                self._fields.update({"energy": self._parse_energy(archive), "level": self._parse_level(archive)})
+            else:
+                occ, virt = self._read_orbitals(self._section("state" if "state" in self._index else "unable"))
+                self._fields.update({"homo": -occ[-1], "homo_index": len(occ) - 1,
+                                     "lumo": virt[0], "lumo_index": len(occ)})
+        return self._fields[key]
+
+    @property
+    def input_atoms(self):
+        return self._field("input_atoms")
+
+    @property
+    def mulliken_charge(self):
+        return self._field("mulliken_charge")
+
+    @property
+    def dipole_moment(self):
+        return self._field("dipole_moment")
+
+    @property
+    def homo(self):
+        return self._field("homo")
+
+    @property
+    def lumo(self):
+        return self._field("lumo")
+
+    @property
+    def homo_index(self):
+        return self._field("homo_index")
+
+    @property
+    def lumo_index(self):
+        return self._field("lumo_index")
+
+    @property
+    def energy(self):
+        return self._field("energy")
+
+    @property
+    def level(self):
+        return self._field("level")
+
 
 class FCHKFile(object):
-    def __init__(self, name="result.fchk"):
+    """
+    Formatted checkpoint reader
+
+    <read> only builds a header index of the file (scalar values, array types/lengths and byte offsets), arrays are
+    decoded on demand from a memory map. The fixed-width fields are converted by numpy directly, so no Python
+    object is created per number, and a slice of an array (e.g., the HOMO/LUMO rows) can be decoded alone.
+
+    """
+    # array type => (fields per line, field width)
+    _layout = {"R": (5, 16), "I": (6, 12), "C": (5, 12), "L": (72, 1)}
+
+    def __init__(self, name="result.fchk", dtype=np.float64):
         self.name = name
-        self.coeff = None
+        self.dtype = dtype
+        self.index = None
+        self._coeff = None
 
+    @metrics.timed("parse.fchk")
     def read(self):
-        with open(self.name, "r") as f:
-            self._strings = f.readlines()
-
-        # read Alpha MO coefficients
-        basis_num, lns, lne = None, -1, -1
-        for index, line in enumerate(self._strings):
-            if line.startswith("Number of basis functions"):
-                basis_num = int(line.split()[-1])
-            elif line.startswith("Alpha MO coefficients"):
-                lns = index
-            elif line.startswith("Beta MO coefficients"):
-                lne = index
-                break
-            elif line.startswith("Orthonormal basis"):
-                lne = index
-                break
-        coeff = list(map(float, [item for line in self._strings[lns + 1:lne] for item in line.split()]))
-        coeff = np.array(coeff).reshape((basis_num, -1))
-        self.coeff = coeff
+        self.index = {}
+        with open(self.name, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            while pos < len(mm):
+                match = _FCHK_HEADER.match(mm, pos)
+                if match is None:
+                    pos = mm.find(b"\n", pos) + 1 or len(mm)
+                    continue
+
+                key, dtype, is_array, value = match.groups()
+                key, dtype, pos = key.decode().strip(), dtype.decode(), match.end()
+                if not is_array:
+                    self.index[key] = {"type": dtype, "value": {"I": int, "R": float}.get(dtype, bytes.decode)(value)}
+                    continue
+
+                # jump over the fixed-width data block, fall back to line scanning if the layout is unexpected
+                self.index[key] = {"type": dtype, "size": int(value), "offset": pos}
+                per_line, _ = self._layout[dtype]
+                data_lines = -(-int(value) // per_line)
+                if data_lines:
+                    line_len = mm.find(b"\n", pos) - pos + 1
+                    skip = mm.find(b"\n", pos + (data_lines - 1) * line_len) + 1 or len(mm)
+                    if skip == len(mm) or mm[skip:skip + 1].isalpha():
+                        pos = skip
 
         return self
 
+    def get(self, key, start=0, stop=None, dtype=None):
+        """
+        Decode the named entry, or only the elements [start, stop) of an array
+
+        Args:
+            key: entry name, e.g., "Alpha MO coefficients"
+            start: first element of the array slice
+            stop: end of the array slice, default: the array length
+            dtype: numpy dtype of a real array, default: <self.dtype>
+
+        Returns:
+            value: scalar value, or 1-D numpy array
+        """
+        if self.index is None:
+            self.read()
+        entry = self.index[key]
+        if "value" in entry:
+            return entry["value"]
+        if entry["type"] not in ("R", "I"):
+            raise NotImplementedError(f"Array type <{entry['type']}> of <{key}> is not supported")
+
+        per_line, width = self._layout[entry["type"]]
+        dtype = (self.dtype if dtype is None else dtype) if entry["type"] == "R" else np.int64
+        stop = entry["size"] if stop is None else min(stop, entry["size"])
+        if stop <= start:
+            return np.empty(0, dtype=dtype)
+
+        with open(self.name, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = entry["offset"]
+            line_len = mm.find(b"\n", offset) - offset + 1
+            begin = offset + (start // per_line) * line_len + (start % per_line) * width
+            end = offset + ((stop - 1) // per_line) * line_len + ((stop - 1) % per_line + 1) * width
+            buffer = mm[begin:end].replace(b"\r", b"").replace(b"\n", b"")
+
+        if len(buffer) != (stop - start) * width:
+            raise FileFormatError(f"The <{key}> block of {self.name} is not in fixed-width format")
+        return np.frombuffer(buffer, dtype=f"S{width}").astype(dtype)
+
+    @property
+    def basis_num(self):
+        return self.get("Number of basis functions")
+
+    def mo_coefficients(self, rows=None, spin="Alpha"):
+        """
+        Decode the MO coefficients, one row per orbital
+
+        Args:
+            rows: orbital indexes to decode, default: all orbitals
+            spin: "Alpha" or "Beta"
+
+        Returns:
+            coeff (np.ndarray): shape (len(rows), basis_num)
+        """
+        key, basis_num = f"{spin} MO coefficients", self.basis_num
+        if rows is None:
+            return self.get(key).reshape((-1, basis_num))
+        return np.stack([self.get(key, row * basis_num, (row + 1) * basis_num) for row in rows])
+
+    @property
+    def coeff(self):
+        if self._coeff is None:
+            self._coeff = self.mo_coefficients()
+        return self._coeff
+
+
+def _read_out_record(name, cache=None):
+    """
+    Process-pool worker of <OUTBatch>, parse one output into a flat record (None if it can not be parsed)
+
+    """
+    try:
+        out = OUTFile(name).read() if cache is None else cache.read(name, "OUTFile")
+    except Exception as error:
+        logger.warning(f"{name} can not be parsed: {error!r}")
+        return None
+    return {"num_atoms": len(out.input_atoms), "homo": out.homo, "lumo": out.lumo,
+            "homo_index": out.homo_index, "lumo_index": out.lumo_index,
+            "dipole": [out.dipole_moment[axis] for axis in ("X", "Y", "Z", "Tot")],
+            "energy": [out.energy.get(key, np.nan) for key in OUTBatch.energy_keys],
+            "mulliken_charge": out.mulliken_charge}
+
+
+class OUTBatch(object):
+    """
+    Parse every Gaussian output under a directory tree in a process pool into one columnar table
+
+    An optional <ParseCache> (calculator/cache.py) skips the outputs parsed by a former run. The table has one row
+    per molecule. Scalar fields are 1-D arrays, the Mulliken charges are stored as a ragged
+    array: the charges of row i are charge[charge_offset[i]:charge_offset[i + 1]].
+
+    """
+    energy_keys = ['HF', 'ZeroPoint', 'Thermal', 'ETot', 'HTot', 'GTot']
+
+    def __init__(self, root, workers=None, pattern="*.out", chunksize=16, cache=None):
+        self.root = Path(root)
+        self.cache = cache
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.pattern = pattern
+        self.chunksize = chunksize
+        self.table = None
+        self.failed = None
+
+    @property
+    def files(self):
+        return sorted(self.root.rglob(self.pattern))
+
+    def read(self):
+        files = self.files
+        start = time.perf_counter()
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                records = merge_collected(executor.map(partial(collected, _read_out_record, cache=self.cache),
+                                                       map(str, files), chunksize=self.chunksize))
+        else:
+            records = [_read_out_record(str(file), self.cache) for file in files]
+        elapsed = time.perf_counter() - start
+
+        parsed = [(file, record) for file, record in zip(files, records) if record is not None]
+        self.failed = [str(file) for file, record in zip(files, records) if record is None]
+        self.table = self._to_columns(parsed)
+        logger.info(f"{len(parsed)}/{len(files)} outputs parsed in {elapsed:.1f}s with {self.workers} workers "
+                    f"({len(files) / max(elapsed, 1e-9):.1f} files/s)")
+
+        return self
+
+    def _to_columns(self, parsed):
+        records = [record for _, record in parsed]
+        charges = [record["mulliken_charge"] for record in records]
+        table = {"name": np.array([str(file.relative_to(self.root).with_suffix('')) for file, _ in parsed]),
+                 "num_atoms": np.array([record["num_atoms"] for record in records], dtype=np.int32),
+                 "homo_index": np.array([record["homo_index"] for record in records], dtype=np.int32),
+                 "lumo_index": np.array([record["lumo_index"] for record in records], dtype=np.int32),
+                 "homo": np.array([record["homo"] for record in records], dtype=np.float64),
+                 "lumo": np.array([record["lumo"] for record in records], dtype=np.float64),
+                 "charge": np.array([charge for row in charges for charge in row], dtype=np.float64),
+                 "charge_offset": np.cumsum([0] + [len(row) for row in charges], dtype=np.int64)}
+        dipole = np.array([record["dipole"] for record in records], dtype=np.float64).reshape((-1, 4))
+        table.update({f"dipole_{axis}": dipole[:, index] for index, axis in enumerate(("X", "Y", "Z", "Tot"))})
+        energy = np.array([record["energy"] for record in records], dtype=np.float64).reshape((-1, 6))
+        table.update({key: energy[:, index] for index, key in enumerate(self.energy_keys)})
+        return table
+
+    def charges(self, row):
+        offset = self.table["charge_offset"]
+        return self.table["charge"][offset[row]:offset[row + 1]]
+
+    def write(self, file):
+        """
+        Save the table as .npz, or as .parquet (needs pyarrow) with the charges as a list column
+
+        """
+        if self.table is None:
+            self.read()
+        if Path(file).suffix == ".parquet":
+            import pandas as pd
+
+            columns = {key: value for key, value in self.table.items() if key not in ("charge", "charge_offset")}
+            columns["charge"] = [self.charges(row).tolist() for row in range(len(self.table["name"]))]
+            pd.DataFrame(columns).to_parquet(file)
+        else:
+            np.savez(file, **self.table)
+
+    @staticmethod
+    def load(file):
+        with np.load(file) as data:
+            return {key: data[key] for key in data.files}
+
 
 if __name__ == '__main__':
     pass
\ No newline at end of file
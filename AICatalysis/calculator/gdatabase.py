@@ -1,17 +1,20 @@
+import logging
 import os
 import re
 import json
 import pandas as pd
 import numpy as np
 from pathlib import Path
-import shutil
 
 from AICatalysis.calculator import descriptor
 from AICatalysis.common.constant import *
-from AICatalysis.common.file import CSVIO
 
-from AICatalysis.calculator.gaussian import GJFFile
-from AICatalysis.calculator.smiles import SmilesFile
+from AICatalysis.calculator.gaussian import GJFFile, OUTBatch, route_level, DefaultLevel
+from AICatalysis.calculator.smiles import SmilesFile, SmilesRegistry, canonical
+from AICatalysis.calculator.store import DescriptorStore, structure_key
+from AICatalysis.common.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class GaussianInDir:
@@ -21,52 +24,91 @@ class GaussianInDir:
         self.dir_path = os.path.join(self.parent_path, self.dir_name)
         self.des_path = os.path.join(DescriptorDataDir, dir_name)
 
-    def updatedir(self, smiles_file=None):
+    def updatedir(self, smiles_file=None, workers=1, report_interval=None):
+        """
+        Add the molecules of an update SMILES file, a gjf is only created for the structures not met before
+
+        Repeats are found through a canonical SMILES => name index of the master file (and of the earlier rows of
+        the update itself), so the cost is linear in the size of both files.
+
+        Args:
+            smiles_file: update file under <SmilesDir>, default: <DefaultUpdateSmilesFile>
+            workers: number of processes for the gjf generation
+            report_interval: log the metrics every <report_interval> seconds of the update, default: no report
+
+        Returns:
+            report (pd.DataFrame): one row per update molecule, with its status (new/repeat) and the name it repeats
+        """
         if smiles_file is None:
             smiles_file = DefaultUpdateSmilesFile
         else:
             smiles_file = SmilesDir / smiles_file
-        old_smiles_file = SmilesFile(ReactSmilesFile)
-        update_smiles_file = SmilesFile(smiles_file)
-
-        repeat_index = [index for index, smiles in enumerate(update_smiles_file.smiles.values)
-                        if smiles in old_smiles_file.smiles.values]
-
-        copy_name = []
-        for index in repeat_index:
-            tmp_smile = old_smiles_file[old_smiles_file.smiles == update_smiles_file.smiles[index]][0]
-            copy_name.append(str(tmp_smile[0]) + '-' + tmp_smile[2])
-
-        repeat_name = [str(id) + '-' + str(name) for id, name in zip(update_smiles_file.type_id[repeat_index],
-                                                                update_smiles_file.name[repeat_index])]
-        gjf_index = [index for index in range(len(update_smiles_file)) if index not in repeat_index]
-
-        if self.dir_name == 'reaction_compound':
-            old_smiles_file.concat(update_smiles_file)
-            old_smiles_file.save()
+        with metrics.reporting(report_interval, MetricsFile):
+            old_smiles_file = SmilesFile(ReactSmilesFile)
+            update_smiles_file = SmilesFile(smiles_file)
+
+            known = {}
+            for key, file_name in zip(map(canonical, old_smiles_file.smiles.values), old_smiles_file.file_name.values):
+                known.setdefault(key, file_name)
+
+            gjf_index, status, source = [], [], []
+            for index, (key, file_name) in enumerate(zip(map(canonical, update_smiles_file.smiles.values),
+                                                         update_smiles_file.file_name.values)):
+                if key in known:
+                    status.append("repeat")
+                    source.append(known[key])
+                else:
+                    known[key] = file_name
+                    gjf_index.append(index)
+                    status.append("new")
+                    source.append(None)
+
+            report = pd.DataFrame({"file_name": update_smiles_file.file_name.values,
+                                   "smiles": update_smiles_file.smiles.values,
+                                   "status": status, "source": source})
+            logger.info(f"{len(gjf_index)} new, {status.count('repeat')} repeated molecules in "
+                        f"{Path(smiles_file).name}")
+
+            if self.dir_name == 'reaction_compound':
+                old_smiles_file.concat(update_smiles_file)
+                old_smiles_file.save()
+
+            self._create_gjfs(update_smiles_file, gjf_index, workers)
+            if self.dir_name == 'reaction_compound':
+                self.update_descriptor_dir(update_smiles_file.file_name.values, update_smiles_file.smiles.values)
+            else:
+                self.update_descriptor_dir(update_smiles_file.name.values, update_smiles_file.smiles.values)
 
-        self._create_gjfs(update_smiles_file, gjf_index)
-        self.update_descriptor_dir(copy_name, repeat_name)
+            return report
 
-    def _create_gjfs(self, smiles_file, index):
+    def _create_gjfs(self, smiles_file, index, workers=1):
         if self.dir_name == 'reaction_compound':
             smiles_name = smiles_file.file_name[index]
         else:
             smiles_name = smiles_file.name[index]
-        for smiles, name in zip(smiles_file.smiles[index], smiles_name):
-            self.create_gjf(smiles, name)
+        GJFFile().write_batch(smiles_file.smiles[index], smiles_name, self.dir_path, workers=workers)
 
     def create_gjf(self, smiles, name):
         gjf_file = GJFFile()
         gjf_file.write(smiles, self.dir_path, name)
 
-    def update_descriptor_dir(self, copy_name, repeat_name):
-        for copy_des, repeat_des in zip(copy_name, repeat_name):
-            if os.path.exists(os.path.join(self.des_path, copy_des + '.json')):
-                shutil.copyfile(os.path.join(self.des_path, copy_des + '.json'),
-                            os.path.join(self.des_path, repeat_des + '.json'))
-            else:
-                CSVIO.write([copy_des, repeat_des], DescriptorDir_ / "hold_list", delimiter=' ')
+    def update_descriptor_dir(self, names, smiles):
+        """
+        Register the molecules as aliases of their structure in every descriptor store
+
+        A repeated structure resolves to the descriptors already computed (or to be computed) for its first
+        occurrence, nothing is copied and no hold list is needed. The keys expect the full descriptor sets and the
+        level of theory of the gjf files written by <_create_gjfs>, an output computed otherwise is keyed by its own
+        level when its descriptors are written.
+
+        """
+        gjf_level = route_level(GJFFile().keyword)
+        with DescriptorStore.deferred():
+            for des_class, level in ((descriptor.RdkitDescriptor, None), (descriptor.MultiwinDescriptor, gjf_level),
+                                     (descriptor.TotalDescriptor, gjf_level)):
+                store = DescriptorStore.open(des_class.des_type)
+                for name, smi in zip(names, smiles):
+                    store.alias([f"{self.dir_name}/{name}"], structure_key(smi, level))
 
 
 class DescriptorDir:
@@ -119,7 +161,7 @@ class GaussianOutDir:
         # smiles_table = pd.read_csv(ReactSmilesFile, delimiter=' ')
         # smiles_table.set_index(['index'], inplace=True)
 
-        smiles_table = SmilesFile.read(ReactSmilesFile)
+        smiles_registry = SmilesRegistry.get(ReactSmilesFile)
 
         # compound_descriptor_list = [descriptor.Descriptor(compound).print() for compound in out_file_list]
 
@@ -128,19 +170,37 @@ class GaussianOutDir:
             if os.path.exists(json_path):
                 continue
 
-            try:
-                smiles_type_id = int(Path(compound).stem.split('-')[0])
-                smiles_name = Path(compound).stem.split('-')[1]
-                smiles = smiles_table.loc[(smiles_table['type_id'] == smiles_type_id) &
-                                          (smiles_table['out_name'] == smiles_name), 'smiles'].values[0]
+            smiles = smiles_registry.smiles(Path(compound).stem)
+            if smiles is not None:
                 compound_descriptor = descriptor.Descriptor(compound, smiles=smiles).print(test)
-            except:
+            else:
                 compound_descriptor = descriptor.Descriptor(compound).print(test)
             dict_json = json.dumps(compound_descriptor)
             with open(json_path, 'w+') as f:
                 f.write(dict_json)
 
 
+    def extractor_table(self, chemical=None, workers=None, file=None, cache=None, report_interval=None):
+        """
+        Parse all outputs of one literature folder (or of the whole output tree) in a process pool
+
+        Args:
+            chemical: literature folder under <root_path>/out, default: all of them
+            workers: number of worker processes, default: cpu count
+            file: .npz/.parquet file to save the table
+            cache: <ParseCache> reused across runs, default: no cache
+            report_interval: log the metrics every <report_interval> seconds of the parsing, default: no report
+
+        Returns:
+            batch (OUTBatch): parsed batch, with the columnar <table> and the <failed> outputs
+        """
+        out_path = self.root_path / 'out' if chemical is None else self.root_path / 'out' / chemical
+        with metrics.reporting(report_interval, MetricsFile):
+            batch = OUTBatch(out_path, workers=workers, cache=cache).read()
+        if file is not None:
+            batch.write(file)
+        return batch
+
     def del_prefix(self):
         for liter_file in self.liter_dir:
             out_file_path = os.path.join(self.root_path, liter_file, 'out')
@@ -165,7 +225,9 @@ class ReactionDatabase():
                  des_data=TotalDesDir):
         self.root_path = root_path
         self.des_data = des_data
-        self.database, self.not_find = self._concat(react_data)
+        with metrics.timer("reaction_database.build"):
+            self.database, self.not_find = self._concat(react_data)
+        metrics.incr("rows.reaction", len(self.database))
         self.output()
 
     def _concat(self, react_data):
@@ -174,7 +236,8 @@ class ReactionDatabase():
         concat_data = pd.DataFrame()
         not_find_file = set()
         for _, sample in react_data.iterrows():
-            concat_sample, not_find_file = self._concat_chemical(sample, not_find_file)
+            with metrics.timer("reaction_database.concat_row"):
+                concat_sample, not_find_file = self._concat_chemical(sample, not_find_file)
             concat_data = pd.concat([concat_data, concat_sample], axis=1)
         concat_data = concat_data.T
         concat_data.index = range(len(concat_data))
@@ -183,6 +246,7 @@ class ReactionDatabase():
 
     def _pre_transform(self, react_data):
         # fill paper id
+        metrics.incr("io.csv.bytes_read", os.path.getsize(react_data))
         react_data = pd.read_csv(react_data)
         react_data.iloc[:, 0].fillna(method='ffill', inplace=True)
         react_data['paper_id'] = react_data['paper_id'].astype('int')
@@ -196,49 +260,45 @@ class ReactionDatabase():
 
         reference_index = str(sample[0])
 
+        des_store = DescriptorStore.open(self.des_data)
         for chemical in ChemicalList[:3]:
             if sample[chemical] is np.nan:
                 continue
             sub_pro = reference_index + '-' + sample[chemical]
-            print(sub_pro)
-            sub_pro_json = self.des_data / 'reaction_compound' / (sub_pro + '.json')
-            if not os.path.exists(sub_pro_json):
-                import shutil
-                smiles_file = SmilesFile(ReactSmilesFile)
-                sub_pro_smiles = smiles_file[smiles_file.file_name == sub_pro, 'smiles'][0]
-                candidate_json = [self.des_data / 'reaction_compound' / (smiles_list[3] + '.json')
-                                  for smiles_list in smiles_file[smiles_file.smiles == sub_pro_smiles]
-                                  if smiles_list[3] != sub_pro]
-                for cur_json in candidate_json:
-                    if os.path.exists(cur_json):
-                        shutil.copyfile(cur_json, sub_pro_json)
-                        break
-                else:
-                    not_find_file.add(sub_pro_json.parent.name + '/' + sub_pro_json.name)
+            logger.debug(sub_pro)
+            sub_pro_des = des_store.get('reaction_compound/' + sub_pro)
+            if sub_pro_des is None:
+                # not registered yet, look the structure up directly
+                sub_pro_smiles = SmilesRegistry.get(ReactSmilesFile).smiles(sub_pro)
+                if sub_pro_smiles is not None:
+                    key = structure_key(sub_pro_smiles, DefaultLevel)
+                    sub_pro_des = des_store.get(key)
+                    if sub_pro_des is not None:
+                        des_store.alias(['reaction_compound/' + sub_pro], key)
+                if sub_pro_des is None:
+                    not_find_file.add('reaction_compound/' + sub_pro)
                     continue
-            reagent = pd.read_json(sub_pro_json, orient='index')
-            index = [chemical + '_' + index for index in reagent.index]
-            reagent.index = index
-            concat_sample = pd.concat([concat_sample, reagent.iloc[:, 0]])
+            reagent = pd.Series(sub_pro_des)
+            reagent.index = [chemical + '_' + index for index in reagent.index]
+            concat_sample = pd.concat([concat_sample, reagent])
 
         if pca_data:
-            reagent_path_list = [self.des_data / chemical / ('nan.json') if sample[chemical] is np.nan
-                                else self.des_data / chemical / (sample[chemical] + '.json')
-                                for chemical in ChemicalList[3:]]
+            reagent_names = [chemical + '/nan' if sample[chemical] is np.nan else chemical + '/' + sample[chemical]
+                             for chemical in ChemicalList[3:]]
         else:
-            reagent_path_list = [self.des_data / chemical / (sample[chemical] + '.json')
-                                 for chemical in ChemicalList[3:]
-                                 if sample[chemical] is not np.nan]
-
-        for reagent_json in reagent_path_list:
-            if os.path.exists(reagent_json):
-                reagent = pd.read_json(reagent_json, orient='index')
-                chemical_name = reagent_json.parent.name
-                index = [chemical_name + '_' + str(index) for index in reagent.index]
-                reagent.index = index
-                concat_sample = pd.concat([concat_sample, reagent.iloc[:, 0]])
+            reagent_names = [chemical + '/' + sample[chemical]
+                             for chemical in ChemicalList[3:]
+                             if sample[chemical] is not np.nan]
+
+        for reagent_name in reagent_names:
+            reagent_des = des_store.get(reagent_name)
+            if reagent_des is not None:
+                chemical_name = reagent_name.split('/')[0]
+                reagent = pd.Series(reagent_des)
+                reagent.index = [chemical_name + '_' + str(index) for index in reagent.index]
+                concat_sample = pd.concat([concat_sample, reagent])
             else:
-                not_find_file.add(reagent_json.parent.name + '/' + reagent_json.name)
+                not_find_file.add(reagent_name)
 
         return concat_sample, not_find_file
 
@@ -265,6 +325,9 @@ class ReactionDatabase():
         with open(NotFindFile, 'w', encoding='utf-8') as f:
             for n_file in sorted(list(self.not_find)):
                 print(n_file, file=f)
+        metrics.incr("reaction_database.not_found", len(self.not_find))
+        logger.info(metrics.summary())
+        metrics.dump(MetricsFile)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,193 @@
+import argparse
+import json
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+from AICatalysis.calculator.descriptor import RdkitDescriptor, MultiwinDescriptor, TotalDescriptor
+from AICatalysis.calculator.gaussian import LazyOUTFile
+from AICatalysis.calculator.smiles import SmilesRegistry
+from AICatalysis.calculator.store import DescriptorStore
+from AICatalysis.common.constant import ReactSmilesFile
+from AICatalysis.common.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_out(out_name):
+    LazyOUTFile(out_name).read()
+
+
+def _rdkit(out_name):
+    # as <TotalDescriptor>: from the registry SMILES when the molecule is registered, else from the output geometry
+    smiles = SmilesRegistry.get(ReactSmilesFile).smiles(Path(out_name).stem) if ReactSmilesFile.exists() else None
+    RdkitDescriptor(out_name, smiles=smiles).write()
+
+
+def _multiwfn(out_name):
+    MultiwinDescriptor(out_name).write()
+
+
+def _merge(out_name):
+    TotalDescriptor(out_name).write()
+
+
+class DescriptorPipeline(object):
+    """
+    Dependency-aware, resumable executor of the descriptor stages of many Gaussian outputs
+
+    Every output gets one task per stage, a task is started as soon as the tasks it depends on are done, so the
+    independent ones (e.g., rdkit of a molecule and multiwfn of another) run in parallel in the worker pool. Each
+    finished task is appended to the manifest (JSON lines, the last status of a task wins), a new run skips the
+    tasks already done and retries the failed ones, the dependents of a failed task are left pending. The descriptor
+    stores are saved every <checkpoint> finished tasks, just before their tasks are marked done in the manifest, so
+    a killed run never records a task whose result was not saved.
+
+    Args:
+        out_names: Gaussian .out files, Multiwfn reads the fchk files under the sibling fchk/ directory
+        manifest: JSON lines checkpoint file
+        workers: number of threads, default: cpu count
+        checkpoint: number of finished tasks between two checkpoints
+    """
+    # stage => (function, stages it depends on), in topological order
+    stages = {
+        "parse_out": (_parse_out, ()),
+        "rdkit": (_rdkit, ("parse_out",)),
+        "multiwfn": (_multiwfn, ("parse_out",)),
+        "merge": (_merge, ("rdkit", "multiwfn")),
+    }
+
+    def __init__(self, out_names, manifest="descriptor_manifest.jsonl", workers=None, checkpoint=100):
+        self.out_names = [str(out_name) for out_name in out_names]
+        self.manifest = Path(manifest)
+        self.workers = workers or os.cpu_count()
+        self.checkpoint = checkpoint
+        self._unsaved = []
+
+    def status(self):
+        """
+        Returns:
+            status (dict): {(stage, out_name): "done" or "failed"} of the tasks recorded in the manifest
+        """
+        status = {}
+        if self.manifest.exists():
+            with open(self.manifest, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line of a killed run may be truncated
+                        continue
+                    status[(record["stage"], record["out_name"])] = record["status"]
+        return status
+
+    def pending(self):
+        status = self.status()
+        return [(stage, out_name) for stage in self.stages for out_name in self.out_names
+                if status.get((stage, out_name)) != "done"]
+
+    def plan(self):
+        """
+        Dry run
+
+        Returns:
+            plan (dict): {stage: number of tasks left}, the previously failed ones included
+        """
+        counter = Counter(stage for stage, _ in self.pending())
+        return {stage: counter.get(stage, 0) for stage in self.stages}
+
+    def _record(self, task, status, error=None):
+        record = {"stage": task[0], "out_name": task[1], "status": status}
+        if error is not None:
+            record["error"] = error
+        self._unsaved.append(record)
+        if len(self._unsaved) >= self.checkpoint:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        DescriptorStore.flush()
+        with open(self.manifest, "a") as f:
+            for record in self._unsaved:
+                f.write(json.dumps(record) + "\n")
+        self._unsaved = []
+
+    def _run_task(self, task):
+        stage, out_name = task
+        self.stages[stage][0](out_name)
+        return task
+
+    def run(self):
+        """
+        Run the pending tasks
+
+        Returns:
+            summary (dict): {"done": n, "failed": n, "blocked": n}, blocked tasks depend on a failed one
+        """
+        pending = set(self.pending())
+        done = {task for task, status in self.status().items() if status == "done"}
+        dependents = {stage: [other for other, (_, deps) in self.stages.items() if stage in deps]
+                      for stage in self.stages}
+        summary = Counter()
+
+        def ready(task):
+            stage, out_name = task
+            return task in pending and all((dep, out_name) in done for dep in self.stages[stage][1])
+
+        with DescriptorStore.deferred(), ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {}
+
+            def submit(tasks):
+                for task in sorted(task for task in tasks if ready(task)):
+                    pending.discard(task)
+                    running[executor.submit(self._run_task, task)] = task
+
+            submit(list(pending))
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    (stage, out_name) = task = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        done.add(task)
+                        self._record(task, "done")
+                        summary["done"] += 1
+                        submit([(dependent, out_name) for dependent in dependents[stage]])
+                    else:
+                        self._record(task, "failed", f"{type(error).__name__}: {error}")
+                        logger.warning(f"{stage} of {out_name} failed: {error}")
+                        summary["failed"] += 1
+            self._checkpoint()
+
+        summary["blocked"] = len(pending)
+        return dict(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the descriptor stages of Gaussian outputs")
+    parser.add_argument("out_dir", help="directory of .out files")
+    parser.add_argument("--manifest", default=None, help="default: <out_dir>/descriptor_manifest.jsonl")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true", help="only print the tasks left per stage")
+    parser.add_argument("--metrics-interval", type=float, default=None,
+                        help="log the metrics every <seconds> of the run, default: no report")
+    parser.add_argument("--metrics-file", default=None, help="JSON file the reported metrics are dumped to")
+    args = parser.parse_args()
+    if args.metrics_interval:
+        logging.basicConfig(level=logging.INFO)
+
+    out_names = sorted(str(name) for name in Path(args.out_dir).glob("*.out"))
+    manifest = args.manifest or Path(args.out_dir) / "descriptor_manifest.jsonl"
+    pipeline = DescriptorPipeline(out_names, manifest=manifest, workers=args.workers)
+    if args.dry_run:
+        for stage, count in pipeline.plan().items():
+            print(f"{stage:<12}{count:>8}")
+    else:
+        with metrics.reporting(args.metrics_interval, args.metrics_file):
+            summary = pipeline.run()
+        print(summary)
+
+
+if __name__ == '__main__':
+    main()
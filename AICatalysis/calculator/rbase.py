@@ -1,71 +1,194 @@
 import os
+import re
+import threading
 from collections import Counter
 
 import numpy as np
+from scipy import sparse
 from rdkit import Chem
+from rdkit import DataStructs
 from rdkit import RDLogger
-from rdkit.Chem import AllChem, MolSurf, rdFreeSASA, Descriptors3D, rdPartialCharges
+from rdkit.Chem import AllChem, MolSurf, rdFreeSASA, Descriptors3D, rdPartialCharges, rdMolTransforms, rdShapeHelpers
 from rdkit.Chem import FragmentCatalog
 from rdkit.Chem import RDConfig
+from rdkit.Chem import rdDetermineBonds
+from rdkit.Geometry import Point3D, UniformGrid3D
 
-from AICatalysis.common.error import FileFormatError
+from AICatalysis.common.error import FileFormatError, StructureError
 
 # close the rdkit warning
 RDLogger.DisableLog('rdApp.warning')
 
+GasConstant = 1.987204e-3  # kcal/(mol K), the force-field energies are in kcal/mol
+EnsembleDescriptors = ("TPSA", "FreeSASA", "volume", "PMI1", "PMI2", "PMI3")
+
+
+def thread_budget(num_threads=None):
+    """
+    Args:
+        num_threads: threads wanted, None or 0 (RDKit's convention): all the CPUs available to the process
+
+    Returns:
+        num_threads (int): <num_threads> capped by the CPUs available to the process
+    """
+    available = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    return available if not num_threads else max(1, min(num_threads, available))
+
+
+def conformer_volume(rmol, conf_id=-1, grid_spacing=0.2, box_margin=2.0):
+    """
+    Same grid-encoded volume as <AllChem.ComputeMolVolume>, whose occupied voxels are counted in numpy instead of a
+    Python loop over the (~10^6) grid points, ~20x faster
+
+    """
+    mol = Chem.Mol(rmol, confId=conf_id)
+    conformer = mol.GetConformer()
+    rdMolTransforms.CanonicalizeConformer(conformer, ignoreHs=False)
+    low, high = rdShapeHelpers.ComputeConfBox(conformer)
+    shape = UniformGrid3D(high.x - low.x + 2 * box_margin, high.y - low.y + 2 * box_margin,
+                          high.z - low.z + 2 * box_margin, spacing=grid_spacing)
+    rdShapeHelpers.EncodeShape(mol, shape, -1, ignoreHs=False, vdwScale=1.0)
+    occupancy = np.zeros(0)
+    DataStructs.ConvertToNumpyArray(shape.GetOccupancyVect(), occupancy)
+    return grid_spacing ** 3 * np.count_nonzero(occupancy == 3)
+
+
+class FunctionalGroups(object):
+    """
+    RDKit functional-group catalog (<RDConfig.RDDataDir>/FunctionalGroups.txt), loaded once per process
+
+    The parameters of the fragment catalog and the group patterns are built at the first <get> and shared by all the
+    molecules. Each pattern is already a compiled query molecule, together with the elements it needs, so <annotate>
+    only runs the substructure searches which can match. As in the fragment catalog, the first atom of a pattern is
+    the attachment point and the patterns are tried in the file order, an atom belonging to the first group found
+    (e.g., the oxygens of -C(=O)O are not also counted as -O and =O).
+
+    Examples:
+        >>> catalog = FunctionalGroups.get()
+        >>> matrix = catalog.annotate(["CC(=O)O", "CC(=O)OC"])
+        >>> catalog.group_names(matrix)
+        [['-C(=O)O'], ['-C(=O)OMe']]
+    """
+    _catalog = None
+    _lock = threading.Lock()
+
+    def __init__(self, file=None, min_path=1, max_path=6):
+        self.file = file or os.path.join(RDConfig.RDDataDir, 'FunctionalGroups.txt')
+        self.params = FragmentCatalog.FragCatParams(min_path, max_path, self.file)
+        self.patterns = [self.params.GetFuncGroup(index) for index in range(self.params.GetNumFuncGroups())]
+        self.names = [pattern.GetProp('_Name') for pattern in self.patterns]
+        self._elements = [{atom.GetAtomicNum() for atom in pattern.GetAtoms()} - {0} for pattern in self.patterns]
+
+    @classmethod
+    def get(cls):
+        """
+        Returns:
+            catalog (FunctionalGroups): the catalog shared by the process
+        """
+        with cls._lock:
+            if cls._catalog is None:
+                cls._catalog = cls()
+            return cls._catalog
+
+    def annotate(self, molecules, counts=False):
+        """
+        Args:
+            molecules: SMILES or RDKit molecules, the SMILES which can not be parsed give an empty row
+            counts: store the number of occurrences of each group instead of 1
+
+        Returns:
+            matrix (sparse.csr_matrix): int32 (molecules x <names>) matrix
+        """
+        molecules = list(molecules)
+        rows, cols, values = [], [], []
+        for row, mol in enumerate(molecules):
+            if isinstance(mol, str):
+                mol = Chem.MolFromSmiles(mol)
+            if mol is None:
+                continue
+            elements = {atom.GetAtomicNum() for atom in mol.GetAtoms()}
+            claimed = set()
+            for col, (pattern, needed) in enumerate(zip(self.patterns, self._elements)):
+                if not needed <= elements:
+                    continue
+                value = 0
+                for match in mol.GetSubstructMatches(pattern):
+                    if claimed.isdisjoint(match[1:]):
+                        claimed.update(match[1:])
+                        value += 1
+                if value:
+                    rows.append(row)
+                    cols.append(col)
+                    values.append(value if counts else 1)
+        return sparse.csr_matrix((values, (rows, cols)), shape=(len(molecules), len(self.names)), dtype=np.int32)
+
+    def group_names(self, matrix):
+        """
+        Returns:
+            groups (list[list]): names of the groups found in each row of an <annotate> matrix
+        """
+        matrix = sparse.csr_matrix(matrix)
+        return [[self.names[col] for col in matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]]
+                for row in range(matrix.shape[0])]
+
 
 class RAtom(object):
-    searched = []
+    """
+    Lightweight view of one atom of an <RMolecule>, every property is read from the molecule's cached atom table
 
-    def __init__(self, ratom, rposition, mol):
-        self._ratom = ratom
-        self._rposition = rposition
+    """
+    __slots__ = ("_mol", "order")
+
+    def __init__(self, mol, order):
         self._mol = mol
+        self.order = order
 
     def __repr__(self):
         return f"<{self.__class__.__name__} : {self.symbol}{self.explicit_valence} : {self.position}>"
 
     def __sub__(self, other):
-        return np.array(self._rposition - other._rposition)
+        return self._mol.atom_table["position"][self.order] - other._mol.atom_table["position"][other.order]
+
+    def _column(self, key):
+        return self._mol.atom_table[key][self.order]
 
     @property
-    def order(self):
-        return self._ratom.GetIdx()
+    def _ratom(self):
+        return self._mol._rmol.GetAtomWithIdx(int(self.order))
 
     @property
     def mass(self):
-        return self._ratom.GetMass()
+        return float(self._column("mass"))
 
     @property
     def symbol(self):
-        return self._ratom.GetSymbol()
+        return str(self._column("symbol"))
 
     @property
     def position(self):
-        return self._rposition.x, self._rposition.y, self._rposition.z
+        return tuple(self._column("position").tolist())
 
     @property
     def atom_map_num(self):
-        return self._ratom.GetAtomMapNum()
+        return int(self._column("atom_map_num"))
 
     @property
     def atomic_num(self):
-        return self._ratom.GetAtomicNum()
+        return int(self._column("atomic_num"))
 
     @property
     def formal_charge(self):
-        return self._ratom.GetFormalCharge()
+        return int(self._column("formal_charge"))
 
     @property
     def mulliken_charge(self):
-        try:
-            return self._ratom.GetDoubleProp("MullikenCharge")
-        except KeyError:
-            return
+        value = self._column("mulliken_charge")
+        return None if np.isnan(value) else float(value)
 
     @mulliken_charge.setter
     def mulliken_charge(self, value: float):
         self._ratom.SetDoubleProp("MullikenCharge", value)
+        self._mol.atom_table["mulliken_charge"][self.order] = value
 
     @property
     def gasteiger_charge(self):
@@ -77,19 +200,25 @@ class RAtom(object):
 
     @property
     def degree(self):
-        return self._ratom.GetDegree()
+        return int(self._column("degree"))
 
     @property
     def total_degree(self):
-        return self._ratom.GetTotalDegree()
+        return int(self._column("total_degree"))
 
     @property
     def hybridization(self):
-        return self._ratom.GetHybridization()
+        return Chem.HybridizationType.values[int(self._column("hybridization"))]
+
+    @property
+    def neighbor_orders(self):
+        table = self._mol.atom_table
+        return table["neighbors"][table["neighbor_ptr"][self.order]:table["neighbor_ptr"][self.order + 1]]
 
     @property
     def neighbors(self):
-        return [self._mol.atoms[atom.GetIdx()] for atom in self._ratom.GetNeighbors()]
+        atoms = self._mol.atoms
+        return [atoms[index] for index in self.neighbor_orders]
 
     @property
     def coordination_info(self):
@@ -97,7 +226,7 @@ class RAtom(object):
         Used for calculating IC descriptor
 
         """
-        return [atom.total_valence for atom in self.neighbors]
+        return self._mol.atom_table["total_valence"][self.neighbor_orders].tolist()
 
     @property
     def connected(self):
@@ -108,60 +237,77 @@ class RAtom(object):
             connection (list): store the atoms' orders with the connection
 
         """
-        connection = []
-        self._connected(connection)
-
-        return connection
-
-    def _connected(self, connection):
-        for neighbor in self.neighbors:
-            if neighbor.order not in connection:
-                connection.append(neighbor.order)
-                neighbor._connected(connection)
+        return self.get_connected_without_idx(())
 
     def get_connected_without_idx(self, idx):
         """
         Obtain the connected atoms without one index
 
+        The depth-first search keeps an explicit stack, so it is not bounded by the recursion limit, and visits the
+        atoms in the same order as the former recursive search.
+
         Returns:
             connection (list): store the atoms' orders with the connection (include self)
 
         """
-        connection = []
-        self._get_connected_without_idx(connection, idx)
+        table = self._mol.atom_table
+        ptr, neighbors = table["neighbor_ptr"], table["neighbors"].tolist()
+        excluded, visited, connection = set(idx), set(), []
+        stack = [iter(neighbors[ptr[self.order]:ptr[self.order + 1]])]
+        while stack:
+            for neighbor in stack[-1]:
+                if neighbor not in visited and neighbor not in excluded:
+                    visited.add(neighbor)
+                    connection.append(neighbor)
+                    stack.append(iter(neighbors[ptr[neighbor]:ptr[neighbor + 1]]))
+                    break
+            else:
+                stack.pop()
 
         return connection
 
-    def _get_connected_without_idx(self, connection, idx):
-        for neighbor in self.neighbors:
-            if neighbor.order not in connection and neighbor.order not in idx:
-                connection.append(neighbor.order)
-                neighbor._get_connected_without_idx(connection, idx)
-
     @property
     def explicit_valence(self):
-        return self._ratom.GetExplicitValence()
+        return int(self._column("explicit_valence"))
 
     @property
     def implicit_valence(self):
-        return self._ratom.GetImplicitValence()
+        return int(self._column("implicit_valence"))
 
     @property
     def total_valence(self):
-        return self._ratom.GetTotalValence()
+        return int(self._column("total_valence"))
 
     @staticmethod
     def from_sp(symbol, position):
-        return RAtom(Chem.Atom(symbol), position, mol=None)
+        rmol = Chem.RWMol()
+        rmol.AddAtom(Chem.Atom(symbol))
+        conformer = Chem.Conformer(1)
+        conformer.SetAtomPosition(0, Point3D(*map(float, position)))
+        rmol.AddConformer(conformer)
+        rmol.UpdatePropertyCache(strict=False)
+        return RMolecule(rmol.GetMol()).atoms[0]
 
 
 class RMolecule(object):
+    """
+    Wrapper of an RDKit molecule
+
+    The per-atom and per-bond properties are gathered once into numpy tables (<atom_table>, <bond_table>), the
+    <RAtom> objects are views onto them, so the bond, coordination and fragment queries are linear in the size of
+    the molecule. The tables assume that the wrapped molecule is not modified afterwards.
+
+    """
 
     def __init__(self, rmol, remove_H=False):
         if not remove_H:
             self._rmol = rmol
         else:
             self._rmol = Chem.RemoveHs(rmol)
+        self._atom_table = None
+        self._bond_table = None
+        self._atoms = None
+        self._dfs = None
 
     def __repr__(self):
         return f"<{self.__class__.__name__} : {self.rsmiles}>"
@@ -174,14 +320,70 @@ class RMolecule(object):
     def weight(self):
         return Chem.rdMolDescriptors.CalcExactMolWt(self._rmol)
 
+    @property
+    def atom_table(self):
+        """
+        Returns:
+            table (dict): column => array over the atoms, the neighbors are in CSR form, the neighbors of atom i
+                are neighbors[neighbor_ptr[i]:neighbor_ptr[i + 1]], positions are NaN without conformer
+        """
+        if self._atom_table is None:
+            ratoms = list(self._rmol.GetAtoms())
+            num_atoms = len(ratoms)
+            if self._rmol.GetNumConformers():
+                position = np.array(self._rmol.GetConformer().GetPositions(), dtype=np.float64).reshape(-1, 3)
+            else:
+                position = np.full((num_atoms, 3), np.nan)
+            neighbors = [[neighbor.GetIdx() for neighbor in atom.GetNeighbors()] for atom in ratoms]
+            self._atom_table = {
+                "symbol": np.array([atom.GetSymbol() for atom in ratoms], dtype="U3"),
+                "atomic_num": np.array([atom.GetAtomicNum() for atom in ratoms], dtype=np.int16),
+                "mass": np.array([atom.GetMass() for atom in ratoms], dtype=np.float64),
+                "atom_map_num": np.array([atom.GetAtomMapNum() for atom in ratoms], dtype=np.int32),
+                "formal_charge": np.array([atom.GetFormalCharge() for atom in ratoms], dtype=np.int8),
+                "degree": np.array([atom.GetDegree() for atom in ratoms], dtype=np.int16),
+                "total_degree": np.array([atom.GetTotalDegree() for atom in ratoms], dtype=np.int16),
+                "explicit_valence": np.array([atom.GetExplicitValence() for atom in ratoms], dtype=np.int16),
+                "implicit_valence": np.array([atom.GetImplicitValence() for atom in ratoms], dtype=np.int16),
+                "total_valence": np.array([atom.GetTotalValence() for atom in ratoms], dtype=np.int16),
+                "hybridization": np.array([int(atom.GetHybridization()) for atom in ratoms], dtype=np.int8),
+                "aromatic": np.array([atom.GetIsAromatic() for atom in ratoms], dtype=bool),
+                "mulliken_charge": np.array([atom.GetDoubleProp("MullikenCharge") if atom.HasProp("MullikenCharge")
+                                             else np.nan for atom in ratoms], dtype=np.float64),
+                "position": position,
+                "neighbor_ptr": np.cumsum([0] + [len(item) for item in neighbors]).astype(np.int32),
+                "neighbors": np.array([index for item in neighbors for index in item], dtype=np.int32),
+            }
+        return self._atom_table
+
+    @property
+    def bond_table(self):
+        """
+        Returns:
+            table (dict): column => array over the bonds, bond_type holds the RDKit <BondType> values
+        """
+        if self._bond_table is None:
+            rbonds = list(self._rmol.GetBonds())
+            self._bond_table = {
+                "begin": np.array([bond.GetBeginAtomIdx() for bond in rbonds], dtype=np.int32),
+                "end": np.array([bond.GetEndAtomIdx() for bond in rbonds], dtype=np.int32),
+                "bond_type": np.array([int(bond.GetBondType()) for bond in rbonds], dtype=np.int8),
+                "bond_type_as_double": np.array([bond.GetBondTypeAsDouble() for bond in rbonds], dtype=np.float64),
+                "aromatic": np.array([bond.GetIsAromatic() for bond in rbonds], dtype=bool),
+                "conjugated": np.array([bond.GetIsConjugated() for bond in rbonds], dtype=bool),
+                "in_ring": np.array([bond.IsInRing() for bond in rbonds], dtype=bool),
+            }
+        return self._bond_table
+
     @property
     def atoms(self):
-        return [RAtom(atom, self._rmol.GetConformer().GetAtomPosition(index), self) for index, atom in
-                enumerate(self._rmol.GetAtoms())]
+        if self._atoms is None:
+            self._atoms = [RAtom(self, index) for index in range(self.num_atoms)]
+        return self._atoms
 
     @property
     def positions(self):
-        return np.array([atom.position for atom in self.atoms])
+        return self.atom_table["position"].copy()
 
     @property
     def mass_center(self):
@@ -207,19 +409,22 @@ class RMolecule(object):
     def adjacency_matrix(self):
         return Chem.rdmolops.GetAdjacencyMatrix(self._rmol)
 
+    def _bond_dicts(self, indices):
+        bonds, degree = self.bond_table, self.atom_table["degree"].astype(np.float64)
+        bond_degree = (degree[bonds["begin"]] * degree[bonds["end"]]) ** -0.5
+        return [{"idx": int(index),
+                 "bond_type": Chem.BondType.values[int(bonds["bond_type"][index])],
+                 "bond_type_as_double": float(bonds["bond_type_as_double"][index]),
+                 "aromatic": bool(bonds["aromatic"][index]),
+                 "conjugated": bool(bonds["conjugated"][index]),
+                 "in_ring": bool(bonds["in_ring"][index]),
+                 "degree": float(bond_degree[index]),
+                 "begin": int(bonds["begin"][index]),
+                 "end": int(bonds["end"][index])} for index in indices]
+
     @property
     def bonds(self):
-
-        return [{"idx": bond.GetIdx(),
-                 "bond_type": bond.GetBondType(),
-                 "bond_type_as_double": bond.GetBondTypeAsDouble(),
-                 "aromatic": bond.GetIsAromatic(),
-                 "conjugated": bond.GetIsConjugated(),
-                 "in_ring": bond.IsInRing(),
-                 "degree": (self.atoms[bond.GetBeginAtomIdx()].degree * self.atoms[
-                     bond.GetEndAtomIdx()].degree) ** -0.5,
-                 "begin": bond.GetBeginAtomIdx(),
-                 "end": bond.GetEndAtomIdx()} for bond in self._rmol.GetBonds()]
+        return self._bond_dicts(range(len(self.bond_table["begin"])))
 
     @property
     def rings(self):
@@ -245,8 +450,7 @@ class RMolecule(object):
 
     @property
     def groups(self):
-        fName = os.path.join(RDConfig.RDDataDir, 'FunctionalGroups.txt')
-        fparams = FragmentCatalog.FragCatParams(1, 6, fName)
+        fparams = FunctionalGroups.get().params
         fcat = FragmentCatalog.FragCatalog(fparams)
         fcgen = FragmentCatalog.FragCatGenerator()
         fcgen.AddFragsFromMol(self._rmol, fcat)
@@ -263,32 +467,123 @@ class RMolecule(object):
 
         return _groups
 
+    @property
+    def rotate_bond_indices(self):
+        """
+        Returns:
+            indices (np.ndarray): indices of the single, non-conjugated bonds between two heavy atoms
+        """
+        bonds, symbol = self.bond_table, self.atom_table["symbol"]
+        mask = (bonds["bond_type"] == int(Chem.BondType.SINGLE)) & ~bonds["conjugated"] & \
+               (symbol[bonds["begin"]] != "H") & (symbol[bonds["end"]] != "H")
+        return np.flatnonzero(mask)
+
     @property
     def rotate_bonds(self):
-        _rotate_bonds = []
-        for bond in self.bonds:
-            bond_type = bond['bond_type']
-            conjugated = bond['conjugated']
-            begin_atom = self.atoms[bond['begin']]
-            end_atom = self.atoms[bond['end']]
-            if bond_type == Chem.rdchem.BondType.SINGLE and not conjugated and begin_atom.symbol != "H" and end_atom.symbol != "H":
-                _rotate_bonds.append(bond)
-        return _rotate_bonds
+        return self._bond_dicts(self.rotate_bond_indices)
+
+    @property
+    def dfs_forest(self):
+        """
+        One iterative depth-first search over all the atoms, with the low-links of Tarjan's algorithm
+
+        Returns:
+            dfs (dict): preorder (atoms in visiting order), tin (preorder position of each atom), tout (last preorder
+                position of its subtree, so that a subtree is the slice preorder[tin:tout + 1]), low, parent (-1 for
+                the roots), root (root of each atom's tree)
+        """
+        if self._dfs is None:
+            table = self.atom_table
+            ptr, neighbors = table["neighbor_ptr"].tolist(), table["neighbors"].tolist()
+            num_atoms = len(ptr) - 1
+            tin, tout, low = [-1] * num_atoms, [-1] * num_atoms, [-1] * num_atoms
+            parent, root, preorder = [-1] * num_atoms, [-1] * num_atoms, []
+            for start in range(num_atoms):
+                if tin[start] != -1:
+                    continue
+                tin[start] = low[start] = len(preorder)
+                root[start] = start
+                preorder.append(start)
+                stack = [(start, ptr[start])]
+                while stack:
+                    atom, cursor = stack[-1]
+                    if cursor < ptr[atom + 1]:
+                        stack[-1] = (atom, cursor + 1)
+                        neighbor = neighbors[cursor]
+                        if tin[neighbor] == -1:
+                            parent[neighbor], root[neighbor] = atom, start
+                            tin[neighbor] = low[neighbor] = len(preorder)
+                            preorder.append(neighbor)
+                            stack.append((neighbor, ptr[neighbor]))
+                        elif neighbor != parent[atom]:
+                            low[atom] = min(low[atom], tin[neighbor])
+                    else:
+                        stack.pop()
+                        tout[atom] = len(preorder) - 1
+                        if parent[atom] != -1:
+                            low[parent[atom]] = min(low[parent[atom]], low[atom])
+            self._dfs = {key: np.array(value, dtype=np.int32) for key, value in
+                         (("preorder", preorder), ("tin", tin), ("tout", tout), ("low", low), ("parent", parent),
+                          ("root", root))}
+        return self._dfs
+
+    def side(self, atom, removed):
+        """
+        Atoms still connected to <atom> once the atom <removed> (one of its neighbors) is taken away
+
+        With the DFS forest, the component of <atom> is either the subtree of the child of <removed> it belongs to
+        (when that child is separated from the rest, low >= tin[removed]), or the tree of <removed> minus <removed>
+        and minus its separated child subtrees, so it is assembled from a few slices of the preorder in O(size).
+        As in <RAtom.get_connected_without_idx>, <atom> itself is only included when it has another neighbor.
+
+        Returns:
+            side (np.ndarray): sorted atom orders
+        """
+        dfs, table = self.dfs_forest, self.atom_table
+        preorder, tin, tout, low, parent = dfs["preorder"], dfs["tin"], dfs["tout"], dfs["low"], dfs["parent"]
+        children = table["neighbors"][table["neighbor_ptr"][removed]:table["neighbor_ptr"][removed + 1]]
+        children = children[parent[children] == removed]
+        separated = children[low[children] >= tin[removed]]
+
+        if tin[removed] < tin[atom] <= tout[removed]:
+            child = children[(tin[children] <= tin[atom]) & (tin[atom] <= tout[children])][0]
+        else:
+            child = None
+
+        if child is not None and low[child] >= tin[removed]:
+            side = preorder[tin[child]:tout[child] + 1]
+        else:
+            tree_root = dfs["root"][removed]
+            cuts = sorted([(tin[removed], tin[removed])] + [(tin[c], tout[c]) for c in separated])
+            start, pieces = tin[tree_root], []
+            for cut_start, cut_stop in cuts:
+                pieces.append(preorder[start:cut_start])
+                start = cut_stop + 1
+            pieces.append(preorder[start:tout[tree_root] + 1])
+            side = np.concatenate(pieces)
+
+        if table["degree"][atom] == 1:
+            side = side[side != atom]
+        return np.sort(side)
 
     @property
     def fragments(self):
         """
         Cut molecule based on rotate bonds
 
+        Both sides of every rotatable bond come from one DFS of the molecule (see <side>), instead of two searches
+        per bond.
+
         Returns:
-            frags (list[tuple, list]): tuple represent the cut-bonds, while the list represent the fragment
+            frags (list[tuple, np.ndarray]): tuple represent the cut-bonds, while the sorted index array represent
+                the fragment
         """
+        bonds = self.bond_table
         frags = []
-        for bond in self.rotate_bonds:
-            begin_idx = bond['begin']
-            end_idx = bond['end']
-            frags.append(((begin_idx, end_idx), sorted(self.atoms[begin_idx].get_connected_without_idx([end_idx])),))
-            frags.append(((begin_idx, end_idx), sorted(self.atoms[end_idx].get_connected_without_idx([begin_idx])),))
+        for index in self.rotate_bond_indices:
+            begin_idx, end_idx = int(bonds["begin"][index]), int(bonds["end"][index])
+            frags.append(((begin_idx, end_idx), self.side(begin_idx, end_idx)))
+            frags.append(((begin_idx, end_idx), self.side(end_idx, begin_idx)))
         return frags
 
     @property
@@ -297,9 +592,10 @@ class RMolecule(object):
         Used for calculating IC descriptor
 
         """
-        _coord = []
-        for atom in self.atoms:
-            _coord.append(tuple(sorted(atom.coordination_info)))
+        table = self.atom_table
+        valence = table["total_valence"][table["neighbors"]]
+        ptr = table["neighbor_ptr"]
+        _coord = [tuple(sorted(valence[ptr[index]:ptr[index + 1]].tolist())) for index in range(len(ptr) - 1)]
 
         return Counter(tuple(_coord))
 
@@ -314,7 +610,7 @@ class RMolecule(object):
 
     @property
     def volume(self):
-        return Chem.AllChem.ComputeMolVolume(self._rmol)
+        return conformer_volume(self._rmol)
 
     @property
     def PMI1(self):
@@ -328,16 +624,110 @@ class RMolecule(object):
     def PMI3(self):
         return Descriptors3D.PMI3(self._rmol)
 
+    @property
+    def conformer_energies(self):
+        """
+        Returns:
+            energies (np.ndarray): force-field energy (kcal/mol) of each conformer, NaN when it is not known
+        """
+        return np.array([conformer.GetDoubleProp("energy") if conformer.HasProp("energy") else np.nan
+                         for conformer in self._rmol.GetConformers()])
+
+    def conformer_weights(self, weighting="boltzmann", temperature=298.15):
+        """
+        Args:
+            weighting: "boltzmann" or "mean", the Boltzmann weights fall back to the mean when an energy is unknown
+            temperature: temperature (K) of the Boltzmann weights
+
+        Returns:
+            weights (np.ndarray): weight of each conformer, summing to 1
+        """
+        if weighting not in ("boltzmann", "mean"):
+            raise ValueError(f"unknown weighting {weighting}, expect 'boltzmann' or 'mean'")
+        energies = self.conformer_energies
+        if weighting == "mean" or np.isnan(energies).any():
+            return np.full(len(energies), 1 / len(energies))
+        weights = np.exp(-(energies - energies.min()) / (GasConstant * temperature))
+        return weights / weights.sum()
+
+    def ensemble_descriptors(self, weighting="boltzmann", temperature=298.15):
+        """
+        3D descriptors averaged over all the conformers of the molecule, e.g., embedded by <_from_smiles> with
+        <num_conformers> > 1, instead of taken on one random geometry
+
+        Returns:
+            descriptors (dict): weighted average of <EnsembleDescriptors>
+        """
+        conf_ids = [conformer.GetId() for conformer in self._rmol.GetConformers()]
+        if not conf_ids:
+            raise StructureError(f"{self.rsmiles} has no conformer")
+        radii = rdFreeSASA.classifyAtoms(self._rmol)
+        values = np.array([[rdFreeSASA.CalcSASA(self._rmol, radii, confIdx=conf_id),
+                            conformer_volume(self._rmol, conf_id),
+                            Descriptors3D.PMI1(self._rmol, confId=conf_id),
+                            Descriptors3D.PMI2(self._rmol, confId=conf_id),
+                            Descriptors3D.PMI3(self._rmol, confId=conf_id)] for conf_id in conf_ids])
+        averages = self.conformer_weights(weighting, temperature) @ values
+        # TPSA only depends on the topology
+        return dict(zip(EnsembleDescriptors, [self.TPSA, *averages.tolist()]))
+
     def compute_gasteiger_charge(self):
         rdPartialCharges.ComputeGasteigerCharges(self._rmol)
 
     @staticmethod
-    def _from_smiles(smiles, addHs=True):
+    def _from_smiles(smiles, addHs=True, num_conformers=1, seed=-1, num_threads=1, cache=None):
+        """
+        Args:
+            num_conformers: > 1 embeds an ensemble, see <_embed_conformers>
+            seed: random seed of the embedding, -1 for a random one
+            num_threads: thread budget of the ensemble embedding and optimization, None for all the CPUs
+            cache: <ConformerCache> to reuse the geometries embedded before, e.g., <ConformerCache.get()>
+        """
+        if cache is not None:
+            params = {"method": "ETKDGv3/MMFF", "addHs": addHs, "num_conformers": num_conformers, "seed": seed}
+            return cache.fetch(smiles, params,
+                               lambda: RMolecule._from_smiles(smiles, addHs, num_conformers, seed, num_threads))
         rmol = Chem.MolFromSmiles(smiles)
         if addHs:
             rmol = AllChem.AddHs(rmol)
-        AllChem.EmbedMolecule(rmol)
-        AllChem.MMFFOptimizeMolecule(rmol)
+        if num_conformers == 1:
+            AllChem.EmbedMolecule(rmol, randomSeed=seed)
+            AllChem.MMFFOptimizeMolecule(rmol)
+        else:
+            RMolecule._embed_conformers(rmol, num_conformers, seed, num_threads)
+        return rmol
+
+    @staticmethod
+    def _embed_conformers(rmol, num_conformers, seed=-1, num_threads=1, max_iters=200, prune_rms=-1.0):
+        """
+        Embed <num_conformers> ETKDG conformers of <rmol> (pruned by <prune_rms> if > 0) and optimize them, both in
+        RDKit's threads
+
+        The MMFF energy of each conformer (UFF when MMFF has no parameters, e.g., Cs2CO3, none when neither has,
+        e.g., Pd(OAc)2) is kept as its "energy" property for <conformer_weights>. The conformers whose force field
+        could not be set up get no energy.
+        """
+        num_threads = thread_budget(num_threads)
+        params = AllChem.ETKDGv3()
+        params.randomSeed = seed
+        params.pruneRmsThresh = prune_rms
+        params.numThreads = num_threads
+        conf_ids = AllChem.EmbedMultipleConfs(rmol, num_conformers, params)
+        if not len(conf_ids):
+            params.useRandomCoords = True
+            conf_ids = AllChem.EmbedMultipleConfs(rmol, num_conformers, params)
+        if not len(conf_ids):
+            raise StructureError(f"no conformer of {Chem.MolToSmiles(rmol)} can be embedded")
+
+        if AllChem.MMFFHasAllMoleculeParams(rmol):
+            results = AllChem.MMFFOptimizeMoleculeConfs(rmol, numThreads=num_threads, maxIters=max_iters)
+        elif AllChem.UFFHasAllMoleculeParams(rmol):
+            results = AllChem.UFFOptimizeMoleculeConfs(rmol, numThreads=num_threads, maxIters=max_iters)
+        else:
+            results = []
+        for conformer, (status, energy) in zip(rmol.GetConformers(), results):
+            if status != -1:
+                conformer.SetDoubleProp("energy", energy)
         return rmol
 
     @staticmethod
@@ -347,6 +737,48 @@ class RMolecule(object):
             raise FileFormatError(f"The format of {file} is not correct")
         return rmol, Chem.MolToSmiles(rmol)
 
+    @staticmethod
+    def _from_atoms(atoms, charge=0):
+        """
+        Build an RDKit molecule from Cartesian atoms, e.g., <OUTFile.input_atoms>, with bond and charge perception
+
+        The connectivity is taken from the covalent radii and the bond orders and formal charges from xyz2mol,
+        constrained by the total <charge>. When no bond order assignment exists (e.g., the metal complexes), only
+        the connectivity is kept, with single bonds. No state is shared between calls, so it is deterministic and
+        safe to run in threads or processes.
+
+        Args:
+            atoms: [[symbol, x, y, z], ...], the symbol may carry Gaussian labels such as "C1" or "Pd(Fragment=1)"
+            charge: total charge of the molecule
+
+        Returns:
+            rmol (Chem.Mol), smiles (str)
+        """
+        rmol = Chem.RWMol()
+        conformer = Chem.Conformer(len(atoms))
+        for i, (symbol, x, y, z) in enumerate(atoms):
+            element = re.match(r"[A-Za-z]+|\d+", str(symbol))
+            if element is None:
+                raise FileFormatError(f"Unknown atom <{symbol}>")
+            element = element.group()
+            atom = Chem.Atom(int(element) if element.isdigit() else element.capitalize())
+            rmol.AddAtom(atom)
+            conformer.SetAtomPosition(i, Point3D(float(x), float(y), float(z)))
+        rmol.AddConformer(conformer, assignId=True)
+
+        try:
+            rdDetermineBonds.DetermineBonds(rmol, charge=int(charge))
+        except (ValueError, RuntimeError):
+            rmol = Chem.RWMol(rmol)
+            for bond in list(rmol.GetBonds()):
+                rmol.RemoveBond(bond.GetBeginAtomIdx(), bond.GetEndAtomIdx())
+            rdDetermineBonds.DetermineConnectivity(rmol, charge=int(charge))
+            rmol.UpdatePropertyCache(strict=False)
+            Chem.SanitizeMol(rmol, Chem.SANITIZE_ALL ^ Chem.SANITIZE_PROPERTIES, catchErrors=True)
+
+        rmol = rmol.GetMol()
+        return rmol, Chem.MolToSmiles(rmol)
+
 
 if __name__ == '__main__':
     pass
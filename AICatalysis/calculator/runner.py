@@ -0,0 +1,83 @@
+import logging
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from AICatalysis.common.error import ExternalToolError
+from AICatalysis.common.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ToolRunner(object):
+    """
+    Run an external program (e.g., Multiwfn) in isolation
+
+    Every call gets its own scratch directory as working directory and talks to the program through pipes, so
+    concurrent calls never share files. A call is retried on timeout or non-zero exit status, and raises
+    <ExternalToolError> once the retries are exhausted.
+
+    """
+
+    def __init__(self, executable, timeout=None, retries=1, scratch_root=None):
+        self.executable = executable
+        self.timeout = timeout
+        self.retries = retries
+        self.scratch_root = scratch_root
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} : {self.executable}>"
+
+    def run(self, args, stdin=None):
+        """
+        Args:
+            args: command line arguments, file arguments should be absolute paths
+            stdin: text fed to the standard input, e.g., a Multiwfn menu script
+
+        Returns:
+            stdout (str): standard output of the program
+        """
+        command = [self.executable] + [str(arg) for arg in args]
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.incr(f"tool.{self.executable}.retries")
+            with tempfile.TemporaryDirectory(prefix="tool_", dir=self.scratch_root) as scratch:
+                try:
+                    with metrics.timer(f"tool.{self.executable}"):
+                        process = subprocess.run(command, input=stdin, capture_output=True, text=True,
+                                                 cwd=scratch, timeout=self.timeout)
+                except subprocess.TimeoutExpired:
+                    error = f"timeout after {self.timeout}s"
+                except OSError as exc:
+                    raise ExternalToolError(f"{self.executable} can not be started: {exc}") from exc
+                else:
+                    if process.returncode == 0:
+                        return process.stdout
+                    error = f"exit status {process.returncode}: {process.stderr.strip()[-500:]}"
+            logger.warning(f"{' '.join(command)} failed ({error}), attempt {attempt + 1}/{self.retries + 1}")
+
+        metrics.incr(f"tool.{self.executable}.failures")
+        raise ExternalToolError(f"{' '.join(command)} failed: {error}")
+
+    def map(self, args_list, stdin_list=None, workers=None):
+        """
+        Run many independent calls with a bounded thread pool (the work itself is done by the child processes)
+
+        Returns:
+            outputs (list): standard output of every call, or the <ExternalToolError> it raised
+        """
+        stdin_list = [None] * len(args_list) if stdin_list is None else stdin_list
+
+        def _run(args, stdin):
+            try:
+                return self.run(args, stdin)
+            except ExternalToolError as exc:
+                return exc
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            return list(executor.map(_run, args_list, stdin_list))
+
+
+Multiwfn = ToolRunner("Multiwfn.exe", timeout=3600)
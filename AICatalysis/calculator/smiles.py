@@ -1,54 +1,353 @@
+import os
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
+from rdkit import Chem
+
+from AICatalysis.common.metrics import metrics
+
+
+@lru_cache(maxsize=None)
+def canonical(smiles):
+    """
+    RDKit canonical SMILES, used as the structure key of the SMILES indexes
+
+    Returns:
+        canonical_smiles (str): the canonical SMILES, or <smiles> itself if RDKit can not parse it
+    """
+    mol = Chem.MolFromSmiles(smiles) if isinstance(smiles, str) else None
+    return smiles if mol is None else Chem.MolToSmiles(mol)
 
 
 class SmilesFile:
+    """
+    Space-delimited SMILES file (type_id smiles name) with hash indexes and an append-only journal
+
+    The rows are kept in a list, indexed by SMILES, canonical SMILES (built at the first structure lookup) and
+    file_name (<type_id>-<name>), so lookups and inserts do not scan the table. New rows are appended at once to
+    <file>.journal in the same line format, <read> merges the base file and its journal, <compact> folds the journal
+    and the in-memory edits (<__setitem__>, <__delitem__>) back into the base file. <data> is the table as a
+    DataFrame, built again only after a change.
+
+    """
     header = ['type_id', 'smiles', 'name']
 
     def __init__(self, file):
         self.file = file
-        self.data = self.read(self.file)
+        self._records = []
+        self._by_smiles, self._by_file_name = defaultdict(list), defaultdict(list)
+        self._by_canonical = None
+        self._rows = {}
+        self._edited = False
+        self._data = None
+        data = self.read(self.file)
+        self._append(zip(data.type_id.tolist(), data.smiles.tolist(), data.name.tolist()))
+
+    @staticmethod
+    def journal(file):
+        return Path(str(file) + ".journal")
 
     @classmethod
     def read(cls, file):
-        data = pd.read_csv(file, delimiter=' ', names=cls.header)
-        data['file_name'] =[str(id) + '-' + str(name)
-                            for id, name in zip(data.type_id, data.name)]
+        """
+        Returns:
+            data (DataFrame): rows of <file> followed by those of its journal, with their file_name
+        """
+        frames = []
+        for name in (file, cls.journal(file)):
+            if os.path.exists(name) and os.path.getsize(name):
+                metrics.incr("io.csv.bytes_read", os.path.getsize(name))
+                frames.append(pd.read_csv(name, delimiter=' ', names=cls.header))
+        if not frames:
+            raise FileNotFoundError(f"{file} does not exist")
+        data = pd.concat(frames, ignore_index=True)
+        if len(frames) > 1:
+            # a reader may meet the journal rows twice during a compaction
+            data = data.drop_duplicates(ignore_index=True)
+        data['file_name'] = [str(id) + '-' + str(name)
+                             for id, name in zip(data.type_id, data.name)]
         return data
 
+    @staticmethod
+    def _line(record):
+        return " ".join(str(value) for value in record) + "\n"
+
+    def _append(self, records):
+        added = []
+        for record in records:
+            record = tuple(record)
+            if record in self._rows:
+                continue
+            row = len(self._records)
+            self._records.append(record)
+            self._rows[record] = row
+            self._by_smiles[record[1]].append(row)
+            self._by_file_name[f"{record[0]}-{record[2]}"].append(row)
+            if self._by_canonical is not None:
+                self._by_canonical[canonical(record[1])].append(row)
+            added.append(record)
+        if added:
+            self._data = None
+        return added
+
+    def append(self, records):
+        """
+        Add rows which are not already in the file and write them to the journal
+
+        Args:
+            records: (type_id, smiles, name) rows
+
+        Returns:
+            added (list): the rows really added
+        """
+        added = self._append(records)
+        if added:
+            with open(self.journal(self.file), "a") as f:
+                f.write("".join(self._line(record) for record in added))
+        return added
+
     def concat(self, smiles):
         if isinstance(smiles, pd.DataFrame):
-            self.data = pd.concat([self.data, smiles])
-            self.data.drop_duplicates(inplace=True)
+            self.append(zip(smiles.type_id.tolist(), smiles.smiles.tolist(), smiles.name.tolist()))
         elif isinstance(smiles, SmilesFile):
-            self.data = pd.concat([self.data, smiles.data])
-            self.data.drop_duplicates(inplace=True)
+            self.append(record for record in smiles._records if record is not None)
         else:
             raise NotImplementedError
 
-    def save(self, file=None):
-        self.data.drop('file_name', axis=1, inplace=True)
+    def compact(self, file=None):
+        """
+        Rewrite the base file atomically with every row and drop the journal
+
+        """
+        records = [record for record in self._records if record is not None]
+        target = Path(self.file if file is None else file)
+        temp = target.parent / f"_{target.name}.{os.getpid()}"
+        with open(temp, "w") as f:
+            f.write("".join(self._line(record) for record in records))
+        os.replace(temp, target)
         if file is None:
-            self.data.to_csv(self.file, sep=' ', header=0, index=0)
-        else:
-            self.data.to_csv(file, sep=' ', header=0, index=0)
+            self.journal(self.file).unlink(missing_ok=True)
+            self._edited = False
+
+    def save(self, file=None):
+        """
+        The appended rows are already in the journal, the base file is only rewritten after an edit or a removal,
+        or to save into another <file>
+
+        """
+        if file is not None or self._edited:
+            self.compact(file)
+
+    def get(self, file_name):
+        """
+        Returns:
+            record (tuple): last (type_id, smiles, name) row of <file_name>, None if it is not in the file
+        """
+        rows = self._by_file_name.get(file_name)
+        return self._records[rows[-1]] if rows else None
+
+    def find(self, smiles):
+        """
+        Returns:
+            records (list): the rows of this exact SMILES
+        """
+        return [self._records[row] for row in self._by_smiles.get(smiles, [])]
+
+    def same_structure(self, smiles):
+        """
+        Returns:
+            records (list): the rows whose canonical SMILES equals that of <smiles>
+        """
+        if self._by_canonical is None:
+            self._by_canonical = defaultdict(list)
+            for row, record in enumerate(self._records):
+                if record is not None:
+                    self._by_canonical[canonical(record[1])].append(row)
+        return [self._records[row] for row in self._by_canonical.get(canonical(smiles), [])]
+
+    @property
+    def data(self):
+        if self._data is None:
+            rows = [row for row, record in enumerate(self._records) if record is not None]
+            data = pd.DataFrame([self._records[row] for row in rows], index=rows, columns=self.header)
+            data['file_name'] = [str(id) + '-' + str(name) for id, name in zip(data.type_id, data.name)]
+            self._data = data
+        return self._data
 
     def __len__(self):
-        return len(self.data)
+        return len(self._rows)
+
+    def __contains__(self, file_name):
+        return bool(self._by_file_name.get(file_name))
 
     def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            record = self._records[item] if 0 <= item < len(self._records) else None
+            if record is None:
+                raise KeyError(item)
+            return np.array([*record, f"{record[0]}-{record[2]}"], dtype=object)
         return self.data.loc[item].values
 
+    def _unindex(self, row):
+        record = self._records[row]
+        del self._rows[record]
+        self._by_smiles[record[1]].remove(row)
+        self._by_file_name[f"{record[0]}-{record[2]}"].remove(row)
+        if self._by_canonical is not None:
+            self._by_canonical[canonical(record[1])].remove(row)
+        self._records[row] = None
+
     def __setitem__(self, item, value):
+        """
+        Replace row <item>, or append <value> if <item> is the number of rows. A row edited into the record of
+        another row is merged into it (removed), as the rows are unique.
+
+        """
         if len(value) != len(self.header):
             pass
+        elif item == len(self._records):
+            self.append([value])
+        elif item > len(self._records):
+            raise IndexError(f"row {item} is beyond the {len(self._records)} rows of {self.file}, "
+                             f"set row {len(self._records)} to append one")
         else:
-            self.data.loc[item] = value
+            record = tuple(value)
+            row = self._rows.get(record)
+            if row == item:
+                return
+            if self._records[item] is not None:
+                self._unindex(item)
+            self._edited = True
+            self._data = None
+            if row is not None:
+                return
+            self._records[item] = record
+            self._rows[record] = item
+            self._by_smiles[record[1]].append(item)
+            self._by_file_name[f"{record[0]}-{record[2]}"].append(item)
+            if self._by_canonical is not None:
+                self._by_canonical[canonical(record[1])].append(item)
 
     def __delitem__(self, item):
-        self.data.drop(item, axis=0)
+        if self._records[item] is not None:
+            self._unindex(item)
+            self._edited = True
+            self._data = None
 
     def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
         if hasattr(self.data, name):
             return getattr(self.data, name)
         else:
-            raise AttributeError(f'\'{self.__class__.__name__}\' object has no attribute \'{name}\'')
\ No newline at end of file
+            raise AttributeError(f'\'{self.__class__.__name__}\' object has no attribute \'{name}\'')
+
+
+class SmilesRegistry:
+    """
+    Process-wide, lazily loaded index of a SMILES file
+
+    One registry exists per file and is shared by all its users (see <get>). The file is parsed at the first lookup
+    and parsed again only when its modification time or that of its journal changes, the lookups by <file_name>,
+    <type_id> and canonical SMILES are dict accesses instead of boolean masks over the whole table.
+
+    """
+    _registries = {}
+    _lock = threading.Lock()
+
+    def __init__(self, file):
+        self.file = file
+        self._mtime = None
+        self._data = None
+        self._by_file_name = {}
+        self._by_type_id = {}
+        self._by_canonical = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, file):
+        """
+        Args:
+            file: SMILES file, e.g., <ReactSmilesFile>
+
+        Returns:
+            registry (SmilesRegistry): the registry shared by the process for <file>
+        """
+        key = os.path.abspath(file)
+        with cls._lock:
+            if key not in cls._registries:
+                cls._registries[key] = cls(file)
+            return cls._registries[key]
+
+    def _refresh(self):
+        journal = SmilesFile.journal(self.file)
+        mtime = (os.stat(self.file).st_mtime_ns, os.stat(journal).st_mtime_ns if journal.exists() else None)
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            data = SmilesFile.read(self.file)
+            records = data.to_dict('records')
+            by_type_id = defaultdict(list)
+            for record in records:
+                by_type_id[record['type_id']].append(record)
+            self._data = data
+            self._by_file_name = {record['file_name']: record for record in records}
+            self._by_type_id = dict(by_type_id)
+            self._by_canonical = None
+            self._mtime = mtime
+
+    @property
+    def data(self):
+        self._refresh()
+        return self._data
+
+    def record(self, file_name):
+        """
+        Returns:
+            record (dict): type_id, smiles, name and file_name of <file_name>, None if it is not registered
+        """
+        self._refresh()
+        return self._by_file_name.get(file_name)
+
+    def smiles(self, file_name, default=None):
+        record = self.record(file_name)
+        return default if record is None else record['smiles']
+
+    def type_id(self, type_id):
+        """
+        Returns:
+            records (list): the records of <type_id>
+        """
+        self._refresh()
+        return self._by_type_id.get(type_id, [])
+
+    def same_structure(self, smiles):
+        """
+        Args:
+            smiles: any SMILES of the structure
+
+        Returns:
+            file_names (list): the registered molecules whose canonical SMILES equals that of <smiles>
+        """
+        self._refresh()
+        by_canonical = self._by_canonical
+        if by_canonical is None:
+            by_canonical = defaultdict(list)
+            for file_name, record in self._by_file_name.items():
+                by_canonical[canonical(record['smiles'])].append(file_name)
+            self._by_canonical = by_canonical = dict(by_canonical)
+        return by_canonical.get(canonical(smiles), [])
+
+    def __contains__(self, file_name):
+        self._refresh()
+        return file_name in self._by_file_name
+
+    def __len__(self):
+        self._refresh()
+        return len(self._by_file_name)
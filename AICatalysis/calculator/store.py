@@ -0,0 +1,348 @@
+import argparse
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from AICatalysis.calculator.gaussian import DefaultLevel
+from AICatalysis.calculator.smiles import SmilesFile, canonical
+from AICatalysis.common.file import JsonIO
+from AICatalysis.common.metrics import metrics
+
+
+def store_name(out_name):
+    """
+    Row name of a molecule, <chemical>/<stem>, e.g., ".../out/ligand/12-L1.out" => "ligand/12-L1"
+
+    """
+    out_name = Path(out_name)
+    return f"{out_name.parent.name}/{out_name.stem}"
+
+
+def structure_key(smiles, level=None, profile=None):
+    """
+    Content address of a structure: hash of its canonical SMILES, of the level of theory (method/basis, None for
+    the descriptors which only depend on the topology) and of the descriptor subset (None for the full set)
+
+    Returns:
+        key (str): "#" + 32 hex digits, never a valid <store_name>
+    """
+    content = canonical(smiles) + "|" + ("" if level is None else level.lower())
+    if profile is not None:
+        content += "|" + profile
+    return "#" + hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class DescriptorStore(object):
+    """
+    Single-file store of one descriptor family (rdkit, multiwfn, total or PCA)
+
+    The whole family is one <family>.npz next to its former JSON tree: a float32 (molecules x descriptors) matrix,
+    its column names and its row names (<store_name>), with a dict index name -> row. The descriptors missing for a
+    molecule are NaN. Rows are normally keyed by <structure_key>, each unique structure being computed and stored
+    once, and the literature/compound names are aliases of the key, so a name lookup is two dict hits. A store is
+    shared by the whole process (see <open>), reloaded when the file is changed by another process and saved
+    atomically, one writer process at a time is assumed.
+
+    """
+    _stores = {}
+    _lock = threading.Lock()
+    _deferred = 0
+
+    def __init__(self, file):
+        self.file = Path(file)
+        self._mtime = None
+        self.columns, self.names = [], []
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self._rows, self._cols = {}, {}
+        self.aliases = {}
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    @property
+    def matrix(self):
+        """
+        (molecules x descriptors) view of the buffer, whose capacity grows geometrically so that inserting rows
+        one by one stays linear
+        """
+        return self._buffer[:len(self.names), :len(self.columns)]
+
+    @matrix.setter
+    def matrix(self, matrix):
+        self._buffer = matrix
+
+    def _reserve(self, n_rows, n_cols):
+        capacity_rows, capacity_cols = self._buffer.shape
+        if n_rows <= capacity_rows and n_cols <= capacity_cols:
+            return
+        buffer = np.full((max(n_rows, 2 * capacity_rows if n_rows > capacity_rows else capacity_rows),
+                          max(n_cols, 2 * capacity_cols if n_cols > capacity_cols else capacity_cols)),
+                         np.nan, dtype=np.float32)
+        buffer[:capacity_rows, :capacity_cols] = self._buffer
+        self._buffer = buffer
+
+    @classmethod
+    def open(cls, des_type):
+        """
+        Args:
+            des_type: family directory, e.g., <RdkitDesDir>, its store is <des_type>.npz
+
+        Returns:
+            store (DescriptorStore): the store shared by the process
+        """
+        file = Path(str(des_type) + ".npz")
+        key = os.path.abspath(file)
+        with cls._lock:
+            if key not in cls._stores:
+                cls._stores[key] = cls(file)
+            return cls._stores[key]
+
+    @classmethod
+    @contextmanager
+    def deferred(cls):
+        """
+        Keep the updates of every store in memory and save each changed store once on exit
+
+        """
+        with cls._lock:
+            cls._deferred += 1
+        try:
+            yield
+        finally:
+            with cls._lock:
+                cls._deferred -= 1
+                deferred = cls._deferred
+            if not deferred:
+                cls.flush()
+
+    @classmethod
+    def flush(cls):
+        """
+        Save every store changed in memory, e.g., at a checkpoint of a deferred run
+
+        """
+        with cls._lock:
+            stores = list(cls._stores.values())
+        for store in stores:
+            if store._dirty:
+                store.save()
+
+    def _refresh(self):
+        if self._dirty:
+            return
+        mtime = os.stat(self.file).st_mtime_ns if self.file.exists() else None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime is not None:
+                metrics.incr("io.npz.bytes_read", os.path.getsize(self.file))
+                with np.load(self.file) as data:
+                    self.matrix = data["matrix"]
+                    self.columns, self.names = data["columns"].tolist(), data["names"].tolist()
+                    self.aliases = dict(data["aliases"].tolist()) if "aliases" in data else {}
+                self._rows = {name: row for row, name in enumerate(self.names)}
+                self._cols = {column: col for col, column in enumerate(self.columns)}
+            self._mtime = mtime
+
+    def save(self):
+        with self._lock:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            temp = self.file.parent / f"_{self.file.stem}.{os.getpid()}.npz"
+            np.savez(temp, matrix=self.matrix, columns=np.array(self.columns, dtype=str),
+                     names=np.array(self.names, dtype=str),
+                     aliases=np.array(list(self.aliases.items()), dtype=str).reshape(-1, 2))
+            os.replace(temp, self.file)
+            self._mtime = os.stat(self.file).st_mtime_ns
+            self._dirty = False
+
+    def update(self, records):
+        """
+        Append the new molecules and replace the rows of the known ones
+
+        Args:
+            records: {name: {descriptor: value}} or a DataFrame indexed by name, non-numeric values become NaN
+        """
+        if isinstance(records, pd.DataFrame):
+            records = records.to_dict(orient="index")
+        if not records:
+            return
+        self._refresh()
+
+        with self._lock:
+            new_columns = list(dict.fromkeys(key for des in records.values() for key in des if key not in self._cols))
+            new_names = [name for name in records if name not in self._rows]
+            for column in new_columns:
+                self._cols[column] = len(self.columns)
+                self.columns.append(column)
+            for name in new_names:
+                self._rows[name] = len(self.names)
+                self.names.append(name)
+
+            self._reserve(len(self.names), len(self.columns))
+            matrix = self.matrix
+            for name, des in records.items():
+                row = matrix[self._rows[name]]
+                row[:] = np.nan
+                for key, value in des.items():
+                    row[self._cols[key]] = _to_float(value)
+            self._dirty = True
+
+        if not DescriptorStore._deferred:
+            self.save()
+
+    def alias(self, names, key):
+        """
+        Make <names> aliases of the row <key>, the row does not need to exist yet
+
+        """
+        self._refresh()
+        with self._lock:
+            for name in names:
+                self.aliases[name] = key
+            self._dirty = True
+        if not DescriptorStore._deferred:
+            self.save()
+
+    def resolve(self, name):
+        self._refresh()
+        return self.aliases.get(name, name)
+
+    def rekey(self, keys):
+        """
+        Move the rows stored by name to their structure key and keep the names as aliases, the structures met
+        several times are stored once
+
+        Args:
+            keys: {name: structure key}
+        """
+        self._refresh()
+        records, moved = {}, []
+        for name, key in keys.items():
+            if name in self._rows and name != key:
+                if key not in self._rows and key not in records:
+                    records[key] = self.get(name)
+                moved.append(name)
+        with DescriptorStore.deferred():
+            self.update(records)
+            self.remove(moved)
+            for name in moved:
+                self.alias([name], keys[name])
+
+    def remove(self, names):
+        names = set(names)
+        self._refresh()
+        with self._lock:
+            keep = [row for row, name in enumerate(self.names) if name not in names]
+            self.matrix = self.matrix[keep]
+            self.names = [self.names[row] for row in keep]
+            self._rows = {name: row for row, name in enumerate(self.names)}
+            self._dirty = True
+        if not DescriptorStore._deferred:
+            self.save()
+
+    def get(self, name):
+        """
+        Returns:
+            descriptor (dict): {descriptor: value} of <name> without its NaN values, None if it is not stored
+        """
+        self._refresh()
+        row = self._rows.get(self.aliases.get(name, name))
+        metrics.incr("store.miss" if row is None else "store.hit")
+        if row is None:
+            return None
+        values = self.matrix[row]
+        return {column: float(value) for column, value in zip(self.columns, values) if not np.isnan(value)}
+
+    def frame(self, names=None, chemical=None):
+        """
+        Args:
+            names: row names to take, default: all
+            chemical: only take the molecules of this chemical type, indexed by their stem
+
+        Returns:
+            data (DataFrame): float32 descriptors, the columns which are NaN for every selected row are dropped
+        """
+        self._refresh()
+        if chemical is not None:
+            prefix = chemical + "/"
+            names = [name for name in self.known_names() if name.startswith(prefix)]
+            index = [name[len(prefix):] for name in names]
+        else:
+            names = self.names if names is None else list(names)
+            index = names
+        rows = [self._rows[self.aliases.get(name, name)] for name in names]
+        return pd.DataFrame(self.matrix[rows], index=index, columns=self.columns).dropna(axis=1, how="all")
+
+    def known_names(self):
+        """
+        Returns:
+            names (list): the names, direct or aliased, which resolve to a stored row
+        """
+        self._refresh()
+        aliased = [name for name, key in self.aliases.items() if key in self._rows and name not in self._rows]
+        return [name for name in self.names if not name.startswith("#")] + aliased
+
+    def chemicals(self):
+        return sorted({name.split("/")[0] for name in self.known_names()})
+
+    def __contains__(self, name):
+        self._refresh()
+        return self.aliases.get(name, name) in self._rows
+
+    def __len__(self):
+        self._refresh()
+        return len(self.names)
+
+    @classmethod
+    def migrate(cls, des_type):
+        """
+        One-shot import of the former JSON tree <des_type>/<chemical>/<stem>.json into <des_type>.npz
+
+        Returns:
+            store (DescriptorStore), skipped (list): the files which are empty or not a descriptor dict
+        """
+        store = cls.open(des_type)
+        records, skipped = {}, []
+        for json_file in sorted(Path(des_type).glob("*/*.json")):
+            des = JsonIO.read(json_file)
+            if isinstance(des, dict) and des:
+                records[f"{json_file.parent.name}/{json_file.stem}"] = des
+            else:
+                skipped.append(str(json_file))
+        with cls.deferred():
+            store.update(records)
+        return store, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="migrate descriptor JSON trees into single-file stores")
+    parser.add_argument("des_dirs", nargs="+", help="family directories, e.g., .../rdkit_des .../multiwin_des")
+    parser.add_argument("--smiles", default=None, help="SMILES file to key the rows by structure, e.g., .../smiles")
+    parser.add_argument("--level", default=DefaultLevel, help="level of theory of the keys, 'none' for rdkit")
+    args = parser.parse_args()
+
+    for des_dir in args.des_dirs:
+        store, skipped = DescriptorStore.migrate(des_dir)
+        if args.smiles is not None:
+            level = None if args.level.lower() == "none" else args.level
+            smiles_table = SmilesFile.read(args.smiles)
+            smiles = dict(zip(smiles_table.file_name, smiles_table.smiles))
+            store.rekey({name: structure_key(smiles[name.split("/")[-1]], level)
+                         for name in store.names if name.split("/")[-1] in smiles})
+        print(f"{des_dir}: {len(store)} structures x {len(store.columns)} descriptors, {len(store.aliases)} "
+              f"aliases => {store.file}, {len(skipped)} skipped")
+
+
+if __name__ == '__main__':
+    main()
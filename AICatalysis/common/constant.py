@@ -41,6 +41,7 @@ RootDir = os.path.dirname(SourceDir)
 # Directory constant here
 Calculator = Path("../calculator")
 DatabaseDir = Path("../../database")
+ModelDir = Path(SourceDir) / "model"
 
 ModelDataDir = DatabaseDir / "model_data"
 ReactDataDir = DatabaseDir / "reaction_data"
@@ -55,6 +56,8 @@ DescriptorDataDir = DescriptorDir_ / "descriptor_database"
 PCATotalDesDataDir = DescriptorDir_ / "pca_total_des"
 PCARdkitDesDataDir = DescriptorDir_ / "pca_rdkit_des"
 PCAMulDesDataDir = DescriptorDir_ / "pca_multiwin_des"
+ParseCacheDir = DescriptorDir_ / "parse_cache"
+ConformerCacheDir = DescriptorDir_ / "conformer_cache"
 
 GaussianDataDir = StructDataDir / "gaussian_data"
 
@@ -68,6 +71,7 @@ ReactionFile = ReactDataDir / "reaction_dataset.csv"
 NotFindFile = ReactDataDir / "not_find_file_list"
 
 ModelData = ModelDataDir / "model_dataset.csv"
+MetricsFile = ModelDataDir / "metrics.json"
 
 ReactSmilesFile = ReactDataDir / "smiles"
 DefaultUpdateSmilesFile = SmilesDir / "smiles"
@@ -75,4 +79,5 @@ DefaultUpdateSmilesFile = SmilesDir / "smiles"
 EAconfig = ModelDir / "ea_config.json"
 
 Elements = Calculator / "element.yaml"
+RdkitCostFile = Path(SourceDir) / "calculator" / "rdkit_cost.yaml"
 
@@ -8,3 +8,7 @@ class StructureError(TypeError):
 
 class ParseError(FileFormatError):
     pass
+
+
+class ExternalToolError(RuntimeError):
+    pass
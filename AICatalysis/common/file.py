@@ -1,11 +1,14 @@
 import hashlib
 import json
+import os
 from collections import defaultdict
 from json import JSONEncoder
 from pathlib import Path
 
 import yaml
 
+from AICatalysis.common.metrics import metrics
+
 
 def md5(name: str):
     return hashlib.md5(name.encode(encoding='utf-8')).hexdigest()
@@ -59,6 +62,7 @@ class JsonIO(object):
         Returns:
             data: python object load from json file
         """
+        metrics.incr("io.json.bytes_read", os.path.getsize(file))
         with open(file, 'r', encoding=encoding) as f:
             data = json.load(f)
         return data
@@ -0,0 +1,254 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """
+    Count, sum, min and max of all the observations, quantiles from a bounded reservoir sample of them
+
+    """
+
+    def __init__(self, size=2048, seed=0):
+        self.size = size
+        self.count, self.sum = 0, 0.0
+        self.min, self.max = float("inf"), float("-inf")
+        self._sample = []
+        self._rng = np.random.default_rng(seed)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min, self.max = min(self.min, value), max(self.max, value)
+        if len(self._sample) < self.size:
+            self._sample.append(value)
+        else:
+            index = self._rng.integers(self.count)
+            if index < self.size:
+                self._sample[index] = value
+
+    def merge(self, other):
+        """
+        Add the observations of <other>, its sample replaces part of ours in proportion to its count
+
+        """
+        if not other.count:
+            return
+        sample = self._sample + other._sample
+        if len(sample) > self.size:
+            weights = np.array([self.count / len(self._sample)] * len(self._sample) +
+                               [other.count / len(other._sample)] * len(other._sample))
+            chosen = self._rng.choice(len(sample), self.size, replace=False, p=weights / weights.sum())
+            sample = [sample[index] for index in chosen]
+        self._sample = sample
+        self.count += other.count
+        self.sum += other.sum
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+
+    def to_dict(self):
+        if not self.count:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(self._sample, [50, 95, 99]).tolist()
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count, "min": self.min,
+                "max": self.max, "p50": p50, "p95": p95, "p99": p99}
+
+
+class Metrics(object):
+    """
+    Process-wide counters, timers and histograms of the pipeline stages
+
+    Counters are plain sums (cache hits, bytes read, rows produced), timers are histograms of wall times in seconds.
+    Every call is guarded by one lock, so the worker threads can share the instance. The worker processes record
+    into their own instance, a task run through <collected> returns what it recorded, which the parent adds with
+    <merge>. A snapshot is a plain dict which can be dumped to JSON, <start_reporting> logs a summary periodically
+    from a daemon thread.
+
+    Examples:
+        >>> metrics.incr("cache.parse.hit")
+        >>> with metrics.timer("parse.out"):
+        ...     out.read()
+        >>> metrics.dump("metrics.json")
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reporter = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = defaultdict(float)
+            self.timers = defaultdict(Histogram)
+            self.histograms = defaultdict(Histogram)
+            self.started = time.time()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def record_time(self, name, seconds):
+        with self._lock:
+            self.timers[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """
+        Decorator which records the wall time of every call under <name>
+
+        """
+
+        def decorate(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+    def export(self):
+        """
+        Returns:
+            state (dict): picklable counters, timers and histograms, see <merge>
+        """
+        with self._lock:
+            return {"counters": dict(self.counters), "timers": dict(self.timers), "histograms": dict(self.histograms)}
+
+    def merge(self, state):
+        """
+        Add the <export> of another process
+
+        """
+        with self._lock:
+            for name, value in state["counters"].items():
+                self.counters[name] += value
+            for name, hist in state["timers"].items():
+                self.timers[name].merge(hist)
+            for name, hist in state["histograms"].items():
+                self.histograms[name].merge(hist)
+
+    def snapshot(self):
+        with self._lock:
+            return {"started": self.started, "elapsed": time.time() - self.started,
+                    "counters": dict(self.counters),
+                    "timers": {name: timer.to_dict() for name, timer in self.timers.items()},
+                    "histograms": {name: hist.to_dict() for name, hist in self.histograms.items()}}
+
+    def dump(self, file):
+        with open(file, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def summary(self):
+        """
+        Returns:
+            summary (str): one line per counter and timer, the timers sorted by total time
+        """
+        snapshot = self.snapshot()
+        lines = [f"metrics after {snapshot['elapsed']:.0f}s"]
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"  {name:<40}{value:>14.0f}")
+        for name, timer in sorted(snapshot["timers"].items(), key=lambda item: -item[1].get("sum", 0)):
+            lines.append(f"  {name:<40}{timer['count']:>8} calls {timer['sum']:>10.2f}s total "
+                         f"{1000 * timer['mean']:>10.2f}ms mean {1000 * timer['p95']:>10.2f}ms p95")
+        for name, hist in sorted(snapshot["histograms"].items()):
+            lines.append(f"  {name:<40}{hist['count']:>8} values {hist['mean']:>12.4g} mean "
+                         f"{hist['min']:>12.4g} min {hist['max']:>12.4g} max")
+        return "\n".join(lines)
+
+    def start_reporting(self, interval=60, file=None):
+        """
+        Log <summary> every <interval> seconds, and also dump the snapshot to <file> if given
+
+        """
+        self.stop_reporting()
+        stop = threading.Event()
+
+        def report():
+            while not stop.wait(interval):
+                logger.info(self.summary())
+                if file is not None:
+                    self.dump(file)
+
+        thread = threading.Thread(target=report, name="metrics-reporter", daemon=True)
+        thread.start()
+        self._reporter = (thread, stop)
+
+    def stop_reporting(self):
+        if self._reporter is not None:
+            thread, stop = self._reporter
+            stop.set()
+            thread.join()
+            self._reporter = None
+
+    @contextmanager
+    def reporting(self, interval=None, file=None):
+        """
+        <start_reporting> for the duration of a batch run, then report once more, nothing if <interval> is None
+
+        Examples:
+            >>> with metrics.reporting(args.metrics_interval, MetricsFile):
+            ...     pipeline.run()
+        """
+        if not interval:
+            yield
+            return
+        self.start_reporting(interval, file)
+        try:
+            yield
+        finally:
+            self.stop_reporting()
+            logger.info(self.summary())
+            if file is not None:
+                self.dump(file)
+
+
+metrics = Metrics()
+
+
+def collected(func, *args, **kwargs):
+    """
+    Process-pool task wrapper, e.g., executor.map(partial(collected, func), ...)
+
+    Returns:
+        result: the result of func(*args, **kwargs)
+        state (dict): the metrics the task recorded in the worker process, to be given to <Metrics.merge>
+    """
+    metrics.reset()
+    result = func(*args, **kwargs)
+    return result, metrics.export()
+
+
+def merge_collected(results):
+    """
+    Returns:
+        results (list): the results of the <collected> tasks, whose metrics are added to <metrics>
+    """
+    values = []
+    for result, state in results:
+        metrics.merge(state)
+        values.append(result)
+    return values
+
+
+if __name__ == '__main__':
+    pass
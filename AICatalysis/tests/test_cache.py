@@ -0,0 +1,60 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from AICatalysis.benchmark.gaussian_bench import write_out_fixture
+from AICatalysis.calculator.cache import ParseCache, ConformerCache
+from AICatalysis.calculator.gaussian import OUTBatch, GJFFile
+
+
+class CachedBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_pickle(self):
+        cache = ParseCache(os.path.join(self.root, "parse_cache"))
+        cache._budget.add(0)
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertIs(copy, ParseCache.get(cache.root))
+        self.assertEqual(copy.max_bytes, cache.max_bytes)
+        cache = ConformerCache(os.path.join(self.root, "conformer_cache"))
+        self.assertIs(pickle.loads(pickle.dumps(cache)), ConformerCache.get(cache.root))
+
+    def test_out_batch(self):
+        out_dir = os.path.join(self.root, "out")
+        os.makedirs(out_dir)
+        for index in range(6):
+            write_out_fixture(os.path.join(out_dir, f"{index}-M{index}.out"), n_atoms=3 + index, n_orbitals=10,
+                              n_padding=10)
+        cache = ParseCache(os.path.join(self.root, "parse_cache"))
+
+        cold = OUTBatch(out_dir, workers=2, chunksize=2, cache=cache).read()
+        self.assertEqual(len(os.listdir(cache.root / "blobs")), 6)
+        warm = OUTBatch(out_dir, workers=2, chunksize=2, cache=cache).read()
+        uncached = OUTBatch(out_dir, workers=1).read()
+
+        self.assertEqual(cold.failed, [])
+        for key, column in uncached.table.items():
+            np.testing.assert_array_equal(cold.table[key], column)
+            np.testing.assert_array_equal(warm.table[key], column)
+
+    def test_gjf_batch(self):
+        cache = ConformerCache(os.path.join(self.root, "conformer_cache"))
+        gjf = GJFFile(num_confs=2, cache=cache)
+        failed = gjf.write_batch(["CCO", "CCN", "CCC"], ["a", "b", "c"], self.root, workers=2)
+
+        self.assertEqual(failed, [])
+        self.assertEqual(len([name for name in os.listdir(cache.root) if name.endswith(".mol")]), 3)
+        self.assertTrue(all(os.path.exists(os.path.join(self.root, f"{name}.gjf")) for name in "abc"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+from AICatalysis.benchmark.gaussian_bench import write_out_fixture
+from AICatalysis.calculator.gaussian import OUTBatch
+from AICatalysis.common.metrics import Histogram, metrics
+
+
+class WorkerMetricsTest(unittest.TestCase):
+
+    def test_histogram_merge(self):
+        first, second = Histogram(size=100), Histogram(size=100)
+        for value in range(300):
+            first.observe(value)
+        for value in range(300, 400):
+            second.observe(value)
+        first.merge(second)
+
+        self.assertEqual(first.count, 400)
+        self.assertEqual(first.sum, sum(range(400)))
+        self.assertEqual((first.min, first.max), (0, 399))
+        self.assertEqual(len(first._sample), 100)
+
+    def test_out_batch_workers(self):
+        with tempfile.TemporaryDirectory() as root:
+            for index in range(5):
+                write_out_fixture(os.path.join(root, f"{index}.out"), n_atoms=3, n_orbitals=10, n_padding=10)
+            metrics.reset()
+            OUTBatch(root, workers=2, chunksize=2).read()
+
+        self.assertEqual(metrics.snapshot()["timers"]["parse.out"]["count"], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
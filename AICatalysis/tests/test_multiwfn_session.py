@@ -0,0 +1,124 @@
+import json
+import os
+import stat
+import sys
+import tempfile
+import unittest
+
+from AICatalysis.benchmark.descriptor_bench import MultiwfnLog
+from AICatalysis.benchmark.gaussian_bench import write_out_fixture, write_fchk_fixture
+from AICatalysis.calculator.descriptor import MultiwinDescriptor
+from AICatalysis.common.metrics import metrics
+
+# fake Multiwfn.exe: records its standard input, then replays the log recorded for it (the session log otherwise)
+FakeMultiwfn = """\
+#!{python}
+import json, sys
+script = sys.stdin.read()
+with open({calls!r}, "a") as f:
+    f.write(json.dumps(script) + "\\n")
+with open({logs!r}) as f:
+    logs = json.load(f)
+sys.stdout.write(logs.get(script, logs["session"]))
+"""
+
+Menu = " ************ Main function menu ************\n"
+
+
+def recorded_logs(session_log):
+    """
+    Returns:
+        logs (dict): Multiwfn script => log, the single run of each analysis and the whole session under "session"
+    """
+    parts = MultiwfnLog.split(Menu)[1:-1]
+    logs = {MultiwinDescriptor.wfn_scripts[analysis] + "q": Menu + part + Menu
+            for analysis, part in zip(MultiwinDescriptor.wfn_scripts, parts)}
+    logs["session"] = session_log
+    return logs
+
+
+class MultiwfnSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+        os.makedirs(os.path.join(self.root, "out"))
+        os.makedirs(os.path.join(self.root, "fchk"))
+        self.out_name = os.path.join(self.root, "out", "1-M1.out")
+        write_out_fixture(self.out_name, n_orbitals=20, n_padding=10,
+                          atoms=[["C", 0.0, 0.0, 0.0], ["H", 0.0, 0.0, 1.09]])
+        write_fchk_fixture(os.path.join(self.root, "fchk", "1-M1.fchk"), basis_num=60)
+
+        self.calls = os.path.join(self.root, "calls.jsonl")
+        bin_dir = os.path.join(self.root, "bin")
+        os.makedirs(bin_dir)
+        executable = os.path.join(bin_dir, "Multiwfn.exe")
+        with open(executable, "w") as f:
+            f.write(FakeMultiwfn.format(python=sys.executable, calls=self.calls,
+                                        logs=os.path.join(self.root, "logs.json")))
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+        self._path = os.environ["PATH"]
+        os.environ["PATH"] = bin_dir + os.pathsep + self._path
+        metrics.reset()
+
+    def tearDown(self):
+        os.environ["PATH"] = self._path
+        self._tmp.cleanup()
+
+    def replay(self, session_log):
+        with open(os.path.join(self.root, "logs.json"), "w") as f:
+            json.dump(recorded_logs(session_log), f)
+
+    def runs(self):
+        """
+        Returns:
+            runs (list): "session" or the analysis of every Multiwfn run
+        """
+        single = {script + "q": analysis for analysis, script in MultiwinDescriptor.wfn_scripts.items()}
+        with open(self.calls) as f:
+            return [single.get(json.loads(line), "session") for line in f]
+
+    def test_session(self):
+        self.replay(MultiwfnLog)
+        des = MultiwinDescriptor(self.out_name).calc_descriptor()
+
+        self.assertEqual(self.runs(), ["session"])
+        self.assertEqual(des["volume"], 250.0)
+        self.assertEqual(des["length_z"], 3.0)
+        self.assertEqual(des["ALIE"], 0.45)
+        self.assertAlmostEqual(des["AvgMullikenBondOrder"], 0.96)
+        self.assertAlmostEqual(des["TotValence"], 2.4)
+        self.assertNotIn("multiwfn.session.mismatch", metrics.counters)
+
+    def test_session_killed(self):
+        # Multiwfn died during the ALIE surface analysis, the ESP and length analyses are complete
+        expected = self._expected()
+        self.replay(Menu.join(MultiwfnLog.split(Menu)[:3]) + Menu + " Average value")
+        with self.assertLogs("AICatalysis.calculator.descriptor", "WARNING") as logs:
+            des = MultiwinDescriptor(self.out_name).calc_descriptor()
+
+        self.assertEqual(self.runs(), ["session", "WfnSurfALIE", "MullikenBondOrder", "MayerValence"])
+        self.assertEqual(des, expected)
+        self.assertEqual(metrics.counters["multiwfn.session.mismatch"], 1)
+        self.assertIn("rerunning WfnSurfALIE, MullikenBondOrder, MayerValence", logs.output[0])
+
+    def test_session_misaligned(self):
+        # the ESP analysis went back to the main menu early, the later parts belong to other analyses
+        expected = self._expected()
+        parts = MultiwfnLog.split(Menu)
+        self.replay(Menu.join(parts[:1] + [" Global surface minimum:   -0.05 a.u. at\n"] + parts[1:]))
+        with self.assertLogs("AICatalysis.calculator.descriptor", "WARNING"):
+            des = MultiwinDescriptor(self.out_name).calc_descriptor()
+
+        self.assertEqual(self.runs(), ["session"] + list(MultiwinDescriptor.wfn_scripts))
+        self.assertEqual(des, expected)
+
+    def _expected(self):
+        self.replay(MultiwfnLog)
+        des = MultiwinDescriptor(self.out_name).calc_descriptor()
+        os.remove(self.calls)
+        return des
+
+
+if __name__ == '__main__':
+    unittest.main()
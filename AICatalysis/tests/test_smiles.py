@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from AICatalysis.calculator.smiles import SmilesFile
+
+
+class SmilesFileEditTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self._tmp.name, "smiles")
+        with open(self.file, "w") as f:
+            f.write("1 CCO ethanol\n1 CCN ethylamine\n2 CCC propane\n")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_edit_into_existing_row(self):
+        smiles_file = SmilesFile(self.file)
+        smiles_file[1] = (1, "CCO", "ethanol")
+        self.assertEqual(len(smiles_file), 2)
+        self.assertEqual(smiles_file.find("CCO"), [(1, "CCO", "ethanol")])
+        self.assertIsNone(smiles_file.get("1-ethylamine"))
+
+        # removing the kept row must not leave the index out of step with the rows
+        del smiles_file[0]
+        self.assertEqual(len(smiles_file), 1)
+        self.assertEqual(smiles_file.find("CCO"), [])
+
+        smiles_file.save()
+        self.assertEqual(len(SmilesFile(self.file)), 1)
+
+    def test_edit_same_record(self):
+        smiles_file = SmilesFile(self.file)
+        smiles_file[0] = (1, "CCO", "ethanol")
+        self.assertEqual(len(smiles_file), 3)
+        self.assertEqual(smiles_file.find("CCO"), [(1, "CCO", "ethanol")])
+
+    def test_edit_beyond_end(self):
+        smiles_file = SmilesFile(self.file)
+        smiles_file[3] = (2, "CCCC", "butane")
+        self.assertEqual(smiles_file.get("2-butane"), (2, "CCCC", "butane"))
+        with self.assertRaisesRegex(IndexError, "set row 4 to append"):
+            smiles_file[10] = (2, "CCCCC", "pentane")
+
+
+if __name__ == '__main__':
+    unittest.main()